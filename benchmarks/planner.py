@@ -0,0 +1,85 @@
+import argparse
+import random
+import time
+
+from sma.environment.routing import StreetGraph, shortest_path
+from sma.environment.street import Street, Orientation
+
+
+# mapa sintético en cuadrícula: calles de un solo sentido que alternan dirección por fila y por columna
+def grid_streets(rows, columns, seed=0):
+    rng = random.Random(seed)
+    streets = {}
+    starting_at = {}
+    ending_at = {}
+
+    def add(orientation, start, end):
+        street = Street(
+            id=len(streets) + 1,
+            length=rng.randint(1, 4),
+            orientation=orientation,
+            elements_at_end=[],
+            has_parking=False
+        )
+        streets[street.id] = street
+        starting_at.setdefault(start, []).append(street)
+        ending_at.setdefault(end, []).append(street)
+
+    for row in range(rows):
+        for column in range(columns - 1):
+            if row % 2 == 0:
+                add(Orientation.EAST, (row, column), (row, column + 1))
+            else:
+                add(Orientation.WEST, (row, column + 1), (row, column))
+    for column in range(columns):
+        for row in range(rows - 1):
+            if column % 2 == 0:
+                add(Orientation.SOUTH, (row, column), (row + 1, column))
+            else:
+                add(Orientation.NORTH, (row + 1, column), (row, column))
+
+    for intersection, incoming in ending_at.items():
+        for street in incoming:
+            street.elements_at_end = [outgoing.start for outgoing in starting_at.get(intersection, [])]
+    return streets
+
+
+def benchmark(sizes, queries, landmarks, seed, congestion):
+    print(f"{'streets':>8} {'preprocess (s)':>15} {'dijkstra (ms)':>14} {'alt (ms)':>9} {'speedup':>8}")
+    for size in sizes:
+        streets = grid_streets(size, size, seed)
+        rng = random.Random(seed)
+        occupancy = {
+            street_id: rng.randint(1, 3) if rng.random() < congestion else 0
+            for street_id in streets
+        }
+
+        plain = StreetGraph(streets)
+        started = time.perf_counter()
+        alt = StreetGraph(streets, landmarks=landmarks)
+        preprocess_time = time.perf_counter() - started
+
+        pairs = [(rng.choice(list(streets)), rng.choice(list(streets))) for _ in range(queries)]
+        timings = []
+        for graph in (plain, alt):
+            started = time.perf_counter()
+            for start_id, goal_id in pairs:
+                shortest_path(graph, start_id, goal_id, occupancy.get)
+            timings.append((time.perf_counter() - started) / queries * 1000)
+
+        print(
+            f"{len(streets):>8} {preprocess_time:>15.3f} {timings[0]:>14.3f} {timings[1]:>9.3f} "
+            f"{timings[0] / timings[1]:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Planner query time against map size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 20, 40, 80], help="Grid side lengths")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per map")
+    parser.add_argument("--landmarks", type=int, default=8, help="ALT landmarks")
+    parser.add_argument("--congestion", type=float, default=0.2, help="Fraction of streets with cars")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    benchmark(args.sizes, args.queries, args.landmarks, args.seed, args.congestion)
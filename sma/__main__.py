@@ -2,16 +2,14 @@ import argparse
 import asyncio
 import json
 import logging
-from enum import Enum
 
-from autogen_core import SingleThreadedAgentRuntime
-
-from sma.agent.driver import DriverAgent
-from sma.agent.parker import ParkerAgent
-from sma.agent.planner import PlannerAgent
-from sma.config import SIMULATION_DELTA, SECONDS, SECONDS_PRE_SIMULATION
-from sma.environment.circuit import Circuit, SimulationHistory, SimulationSnapshot
+from sma.config import SIMULATION_DELTA, SECONDS, SECONDS_PRE_SIMULATION, PLANNER_WORKERS, \
+    HISTORY_KEYFRAME_INTERVAL, MAX_CARS, SPAWN_PROBABILITY, UNPARK_PROBABILITY, MESSAGE_TRANSPORT
+from sma.environment.circuit import Circuit
+from sma.environment.circuitmap import CircuitMap
 from sma.graphics import Graphics
+from sma.history.formats import history_writer, load_history, write_json_history
+from sma.simulation import simulation, TRANSPORTS
 
 # disable logging
 logging.disable(logging.CRITICAL)
@@ -20,86 +18,76 @@ STEPS = int(SECONDS / SIMULATION_DELTA)
 STEPS_PRE_SIMULATION = int(SECONDS_PRE_SIMULATION / SIMULATION_DELTA)
 
 
-async def simulation():
-    circuit = Circuit.get_instance()
-
-    agent_runtime = SingleThreadedAgentRuntime()
-
-    await DriverAgent.register(
-        agent_runtime,
-        "driver",
-        lambda: DriverAgent()
-    )
-    await ParkerAgent.register(
-        agent_runtime,
-        "parker",
-        lambda: ParkerAgent()
-    )
-    await PlannerAgent.register(
-        agent_runtime,
-        "planner",
-        lambda: PlannerAgent()
-    )
-
-    agent_runtime.start()
-    circuit.set_agent_runtime(agent_runtime)
-
-    logging.info(f"Start simulation")
-    for i in range(STEPS_PRE_SIMULATION):
-        await circuit.step(SIMULATION_DELTA)
-
-    for i in range(STEPS):
-        await circuit.step(SIMULATION_DELTA)
-        circuit.take_snapshot()
-
-    logging.info(f"End simulation: number of steps: {STEPS}")
-    circuit.finish()
-
-
 def display_simulation(history):
     Graphics(history).run()
 
 
+def _step_window(text):
+    first, _, stop = text.partition(":")
+    return int(first), int(stop)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("map", type=str, help="Map file")
     parser.add_argument("--output", type=str, help="Output file")
     parser.add_argument("--input", type=str, help="Input file")
+    parser.add_argument("--vectorized", action="store_true",
+                        help="Use the vectorized kinematics engine; cars see each other at the start of each substep, "
+                             "so results are not comparable with the default mode")
+    parser.add_argument("--planner-workers", type=int, default=PLANNER_WORKERS,
+                        help="Processes used to plan routes outside the simulation loop")
+    parser.add_argument("--keyframe-interval", type=int, default=HISTORY_KEYFRAME_INTERVAL,
+                        help="Snapshots between history keyframes, 0 to store every snapshot in full")
+    parser.add_argument("--max-cars", type=int, default=MAX_CARS, help="Maximum number of cars in the circuit")
+    parser.add_argument("--spawn-probability", type=float, default=SPAWN_PROBABILITY,
+                        help="Probability of spawning a car on each substep")
+    parser.add_argument("--unpark-probability", type=float, default=UNPARK_PROBABILITY,
+                        help="Probability of a parked car leaving on each substep")
+    parser.add_argument("--timings", action="store_true",
+                        help="Record the time spent in each phase of the simulation step")
+    parser.add_argument("--profile-steps", type=_step_window, metavar="START:STOP",
+                        help="Profile these steps with cProfile (implies --timings)")
+    parser.add_argument("--profile-output", type=str, default="simulation.prof",
+                        help="File for the --profile-steps profile")
+    parser.add_argument("--message-stats", action="store_true",
+                        help="Record message counts, latencies and handler times of the agents")
+    parser.add_argument("--transport", choices=TRANSPORTS, default=MESSAGE_TRANSPORT,
+                        help="Message transport between agents: the autogen runtime or the in-process direct bus")
 
     args = parser.parse_args()
 
     if args.output is None:
-        args.output = "output.json"
-
-    circuit_data = json.load(open(args.map))
-    Circuit.load_json(circuit_data)
-    circuit = Circuit.get_instance()
+        args.output = "output.hist"
+
+    circuit = Circuit(CircuitMap.load(args.map))
+    if args.vectorized:
+        circuit.enable_kinematics_engine()
+    circuit.max_cars = args.max_cars
+    circuit.spawn_probability = args.spawn_probability
+    circuit.unpark_probability = args.unpark_probability
+    if args.timings or args.profile_steps is not None:
+        circuit.enable_phase_timing(args.profile_steps, args.profile_output)
+    if args.message_stats:
+        circuit.enable_message_stats()
 
     if args.input is None:
-        asyncio.run(simulation())
-        history = circuit.get_history()
-        with open(args.output, "w") as f:
-
-            def to_dict(o):
-                if isinstance(o, Enum):
-                    return o.value
-                if hasattr(o, "__dict__"):
-                    return o.__dict__
-
-
-            history.streets = []
-            json.dump(history, f, default=to_dict)
+        # el histórico se escribe en disco durante la simulación y se vuelve a leer para mostrarlo
+        writer = history_writer(args.output)
+        if writer is not None:
+            circuit.set_history_writer(writer, args.keyframe_interval)
+        try:
+            asyncio.run(simulation(
+                circuit, STEPS, STEPS_PRE_SIMULATION, SIMULATION_DELTA, args.planner_workers, transport=args.transport
+            ))
+        finally:
+            if writer is not None:
+                writer.flush()
+        if writer is None:
+            write_json_history(circuit.get_history(), args.output)
+        history = load_history(args.output)
     else:
-        with open(args.input) as f:
-            data = json.load(f)
-            stats = data["stats"]
-            del data["stats"]
-            history = SimulationHistory(**data)
-            history.history = [
-                SimulationSnapshot(**snapshot)
-                for snapshot
-                in history.history
-            ]
+        history = load_history(args.input)
 
     history.streets = circuit.streets
     print(json.dumps(history.stats, indent=2))
@@ -0,0 +1,63 @@
+from autogen_core import CancellationToken, MessageContext
+
+
+# transporte de mensajes dentro del proceso, alternativo al runtime de autogen para experimentos con muchos coches: los
+# mensajes (las dataclasses de sma/agent/messages.py) se guardan tal cual en una lista y Circuit.step los entrega por
+# lotes llamando directamente al handler del agente, sin serializar ni crear una tarea por mensaje. A diferencia de
+# autogen, send_message no espera a que el destinatario atienda el mensaje
+class DirectMessageBus:
+
+    def __init__(self):
+        self._factories = {}  # tipo de agente -> factoría
+        self._agents = {}  # AgentId -> agente, creado con el primer mensaje que recibe
+        self._pending = []  # (mensaje, destinatario, contexto) en orden de envío
+        self._cancellation_token = CancellationToken()  # compartido: los mensajes del bus no se cancelan
+        self.delivered = 0
+        self.batches = 0
+        self.largest_batch = 0
+
+    async def register_factory(self, type, agent_factory, *, expected_class=None):
+        self._factories[type.type] = agent_factory
+        return type
+
+    async def add_subscription(self, subscription):
+        # sólo hay mensajes directos a un AgentId, así que las suscripciones no se usan
+        pass
+
+    def add_message_serializer(self, serializer):
+        pass
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        self._pending.clear()
+
+    async def send_message(self, message, recipient, *, sender=None, cancellation_token=None, message_id=None):
+        self._pending.append((
+            message,
+            recipient,
+            MessageContext(sender, None, True, self._cancellation_token, message_id or "")
+        ))
+
+    async def deliver(self):
+        # los mensajes enviados mientras se entrega un lote forman el siguiente, hasta vaciar la cola
+        while self._pending:
+            batch, self._pending = self._pending, []
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, len(batch))
+            for message, recipient, ctx in batch:
+                agent = self._agents.get(recipient)
+                if agent is None:
+                    agent = await self._create_agent(recipient)
+                await agent.on_message(message, ctx)
+            self.delivered += len(batch)
+
+    async def _create_agent(self, agent_id):
+        agent = self._factories[agent_id.type]()
+        await agent.bind_id_and_runtime(agent_id, self)
+        self._agents[agent_id] = agent
+        return agent
+
+    def stats(self):
+        return {"delivered": self.delivered, "batches": self.batches, "largest_batch": self.largest_batch}
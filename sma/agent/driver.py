@@ -1,12 +1,11 @@
 import logging
-import random
+import math
 from enum import Enum
 
 from autogen_core import RoutedAgent, message_handler, MessageContext, AgentId
 
 from sma.agent.messages import CarAssignationMessage, PlanRequestMessage, PlanResponseMessage, \
     ParkingAssignationMessage, ParkingRequestMessage, ParkingFoundMessage
-from sma.config import UNPARK_PROBABILITY
 from sma.environment.circuit import Circuit
 
 
@@ -19,9 +18,9 @@ class State(int, Enum):
 
 
 class DriverAgent(RoutedAgent):
-    def __init__(self):
+    def __init__(self, circuit: Circuit):
         super().__init__("driver")
-        self.circuit = Circuit.get_instance()
+        self.circuit = circuit
         self.car = None
         self.state = State.START
         self.achieved_parking = False
@@ -29,21 +28,25 @@ class DriverAgent(RoutedAgent):
         self._time_when_finished_searching = None
         self._plan = None
         self._last_target_street = None
+        self._unpark_tick = None
 
     @message_handler
     async def handle_plan_response(self, message: PlanResponseMessage, ctx: MessageContext) -> None:
-        self._plan = [self.circuit.streets[sid] for sid in message.plan]
+        if message.plan:
+            self._plan = [self.circuit.streets[sid] for sid in message.plan]
+        self.circuit.wake_driver(self.car)
 
     @message_handler
     async def handle_car_assignation(self, message: CarAssignationMessage, ctx: MessageContext) -> None:
         self.car = self.circuit.cars[message.car_id]
         self.circuit.drivers[self.car.id] = self
+        self.circuit.wake_driver(self.car)
         logging.info(f"Car {self.car.id} assigned to driver {self.id}")
 
     @message_handler
     async def handle_parking_assignation(self, message: ParkingAssignationMessage, ctx: MessageContext) -> None:
         if self.state == State.WANTS_TO_PARK:
-            await self.runtime.send_message(
+            await self.send_message(
                 PlanRequestMessage(
                     self.car.street.id,
                     message.street_id
@@ -67,6 +70,21 @@ class DriverAgent(RoutedAgent):
             case State.WANTS_TO_EXIT:
                 await self._go_to_exit()
 
+    def needs_activation(self):
+        if self.car.marked_for_deletion:
+            return False
+
+        match self.state:
+            case State.START:
+                return True
+            case State.WANTS_TO_PARK:
+                return not self.car.is_parked() and (
+                        self._plan is not None or self.car.street.has_parking or self.car.is_at_end()
+                )
+            case State.WANTS_TO_EXIT:
+                return self.car.is_parked() or self._plan is not None or self.car.is_blocked
+        return False
+
     def _set_target_street(self, street):
         self._last_target_street = self.car.target_street
         self.car.target_street = street
@@ -74,15 +92,8 @@ class DriverAgent(RoutedAgent):
     async def _go_to_exit(self):
         if self.car.is_parked():
             if self.car.unpark(self.circuit):
-                desired_exit = random.choice([
-                    street
-                    for street in self.circuit.streets.values()
-                    if any(
-                        type(element) == str and element.startswith("@end")
-                        for element in street.elements_at_end
-                    )
-                ])
-                await self.runtime.send_message(
+                desired_exit = self.circuit.random.choice(self.circuit.map.exit_streets)
+                await self.send_message(
                     PlanRequestMessage(
                         self.car.street.id,
                         desired_exit.id
@@ -95,20 +106,35 @@ class DriverAgent(RoutedAgent):
     def _follow_plan(self):
         plan = self._plan
         if plan is not None:
-            while plan[0] not in self.car.street.available_target_streets():
+            # se descartan las calles ya recorridas y las que no se pueden tomar desde la calle actual
+            if self.car.street in plan:
+                plan = plan[plan.index(self.car.street) + 1:]
+            available_streets = self.car.available_target_streets()
+            while plan and plan[0] not in available_streets:
                 plan = plan[1:]
-            if len(plan) > 0:
+            if plan:
                 self._set_target_street(plan[0])
-                self._plan = plan[1:]
+            self._plan = plan or None
 
         if self.car.is_blocked:
             self._wander()
 
     def _idle(self):
-        if self.car.is_parked():
-            if random.random() < UNPARK_PROBABILITY:
+        if self.car.is_parked() and self._unpark_tick is not None:
+            if self.circuit.activations.tick >= self._unpark_tick:
                 self.state = State.WANTS_TO_EXIT
 
+    def _schedule_unpark(self):
+        # en lugar de tirar una moneda con probabilidad unpark_probability en cada subpaso se muestrea
+        # directamente el subpaso del primer éxito (distribución geométrica)
+        unpark_probability = self.circuit.unpark_probability
+        if unpark_probability <= 0:
+            self._unpark_tick = None
+            return
+        delay = int(math.log(1 - self.circuit.random.random()) / math.log1p(-unpark_probability)) + 1
+        self._unpark_tick = self.circuit.activations.tick + delay
+        self.circuit.activations.wake_at(self.car.id, self._unpark_tick)
+
     async def _try_park(self):
         if self.car.is_parked():
             return
@@ -124,7 +150,9 @@ class DriverAgent(RoutedAgent):
             self.achieved_parking = True
             self._time_when_finished_searching = self.circuit.time
             self.state = State.IDLE
-            await self.runtime.send_message(
+            self._plan = None
+            self._schedule_unpark()
+            await self.send_message(
                 ParkingFoundMessage(
                     self.car.street.id,
                     self.car.position[1]
@@ -139,12 +167,12 @@ class DriverAgent(RoutedAgent):
             if self._last_target_street in available_streets:
                 available_streets.remove(self._last_target_street)
 
-            turns = random.sample(available_streets, len(available_streets))
+            turns = self.circuit.random.sample(available_streets, len(available_streets))
             if len(turns) > 0:
                 self._set_target_street(turns[0])
 
     async def _start(self):
-        await self.runtime.send_message(
+        await self.send_message(
             ParkingRequestMessage(
                 self.car.street.id,
                 self.car.position[1]
@@ -0,0 +1,136 @@
+import itertools
+from collections import defaultdict
+from time import perf_counter
+
+# límites superiores (en segundos) de los cubos del histograma de tiempos de los handlers; el último cubo recoge el resto
+HANDLER_TIME_BUCKETS = ((1e-5, "10us"), (1e-4, "100us"), (1e-3, "1ms"), (1e-2, "10ms"), (1e-1, "100ms"))
+# respuesta -> petición de las idas y vueltas que se miden, desde que un agente envía la petición hasta que le llega la
+# respuesta (el planificador y el aparcador no responden en el mismo handler, sino en su on_tick)
+ROUND_TRIPS = {"PlanResponseMessage": "PlanRequestMessage", "ParkingAssignationMessage": "ParkingRequestMessage"}
+
+
+class _Measure:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def stats(self):
+        return {"average": self.total / self.count if self.count else 0.0, "max": self.max}
+
+
+class _MessageTypeStats:
+
+    def __init__(self):
+        self.sent = 0
+        self.handled = 0
+        self.queue_wait = _Measure()  # desde que se envía hasta que empieza su handler
+        self.latency = _Measure()  # desde que se envía hasta que termina su handler
+        self.sim_latency = _Measure()  # lo mismo en tiempo de simulación
+        self.handler_time = _Measure()
+        self.histogram = [0] * (len(HANDLER_TIME_BUCKETS) + 1)
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "handled": self.handled,
+            "queue_wait": self.queue_wait.stats(),
+            "latency": self.latency.stats(),
+            "sim_latency": self.sim_latency.stats(),
+            "handler_time": {
+                **self.handler_time.stats(),
+                "histogram": dict(zip([label for _, label in HANDLER_TIME_BUCKETS] + ["more"], self.histogram))
+            }
+        }
+
+
+# mensajes entre agentes por tipo: cuántos se envían, cuánto esperan en la cola del runtime, cuánto tardan sus handlers
+# y cuántos llega a haber pendientes a la vez. Se engancha sustituyendo send_message del runtime y on_message de cada
+# agente, así que sin él los mensajes no pagan nada
+class MessageStats:
+
+    def __init__(self, circuit):
+        self.circuit = circuit
+        self._types = defaultdict(_MessageTypeStats)
+        self._in_queue = {}  # message_id -> (tipo, instante de envío, tiempo de simulación del envío)
+        self._requests = {}  # (agente, tipo de petición) -> (instante de envío, tiempo de simulación del envío)
+        self._round_trips = defaultdict(lambda: (_Measure(), _Measure()))  # petición -> (tiempo real, de simulación)
+        self._message_ids = itertools.count()
+        self.peak_queue_depth = 0
+
+    def attach(self, runtime):
+        send_message = runtime.send_message
+
+        async def instrumented_send_message(message, recipient, *, message_id=None, **kwargs):
+            message_id = f"m{next(self._message_ids)}" if message_id is None else message_id
+            message_type = type(message).__name__
+            self._types[message_type].sent += 1
+            self._in_queue[message_id] = (message_type, perf_counter(), self.circuit.time)
+            if kwargs.get("sender") is not None and message_type in ROUND_TRIPS.values():
+                # si el agente repite la petición se mide desde la primera
+                self._requests.setdefault((kwargs["sender"], message_type), self._in_queue[message_id][1:])
+            self.peak_queue_depth = max(self.peak_queue_depth, len(self._in_queue))
+            return await send_message(message, recipient, message_id=message_id, **kwargs)
+
+        runtime.send_message = instrumented_send_message
+
+    def instrument(self, agent):
+        on_message = agent.on_message
+
+        async def instrumented_on_message(message, ctx):
+            start = perf_counter()
+            sent = self._in_queue.pop(ctx.message_id, None)
+            try:
+                return await on_message(message, ctx)
+            finally:
+                end = perf_counter()
+                if sent is not None:
+                    self._handled(sent, start, end)
+                request = ROUND_TRIPS.get(type(message).__name__)
+                if request is not None:
+                    self._round_trip(self._requests.pop((agent.id, request), None), request, end)
+
+        agent.on_message = instrumented_on_message
+        return agent
+
+    def _handled(self, sent, start, end):
+        message_type, sent_at, sent_at_sim = sent
+        stats = self._types[message_type]
+        stats.handled += 1
+        stats.queue_wait.add(start - sent_at)
+        stats.latency.add(end - sent_at)
+        stats.sim_latency.add(self.circuit.time - sent_at_sim)
+        stats.handler_time.add(end - start)
+        bucket = next((i for i, (limit, _) in enumerate(HANDLER_TIME_BUCKETS) if end - start <= limit),
+                      len(HANDLER_TIME_BUCKETS))
+        stats.histogram[bucket] += 1
+
+    def _round_trip(self, requested, request, end):
+        if requested is None:
+            return
+        wall, sim = self._round_trips[request]
+        wall.add(end - requested[0])
+        sim.add(self.circuit.time - requested[1])
+
+    async def on_tick(self):
+        pass
+
+    def stats(self):
+        return {
+            "peak_queue_depth": self.peak_queue_depth,
+            "pending": len(self._in_queue),
+            "round_trips": {
+                request: {"count": wall.count, "wall": wall.stats(), "sim": sim.stats()}
+                for request, (wall, sim) in sorted(self._round_trips.items())
+            },
+            **{message_type: stats.stats() for message_type, stats in sorted(self._types.items())}
+        }
+
+    def close(self):
+        pass
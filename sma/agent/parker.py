@@ -1,3 +1,5 @@
+from collections import deque
+
 from autogen_core import RoutedAgent, message_handler, MessageContext
 
 from sma.agent.messages import ParkingRequestMessage, ParkingAssignationMessage, ParkingFoundMessage, \
@@ -6,65 +8,113 @@ from sma.environment.circuit import Circuit
 
 
 class ParkerAgent(RoutedAgent):
-    def __init__(self):
+    def __init__(self, circuit: Circuit):
         super().__init__("parker")
-        self.circuit = Circuit.get_instance()
-        self.known_spots = []
-        self.requesters_queues = []
-        self.assigned_spots = []
+        self.circuit = circuit
+        self.circuit.services["parker"] = self
+        self.requesters_queue = deque()  # (sender, street_id, position)
+        self.assigned_spots = {}  # sender -> (street_id, position, length, street_id/position de la petición)
+        self.assigned_by_street = {}  # street_id -> {sender, ...}
+        self._pending = False
+        self._parking_version = None
+        self.assignments = 0
+        self.reassignments = 0
 
     @message_handler
     async def handle_parking_request(self, message: ParkingRequestMessage, ctx: MessageContext) -> None:
-        self.requesters_queues.append(ctx.sender)
-        self._assign_spots()
+        self.requesters_queue.append((ctx.sender, message.street_id, message.position))
+        self._pending = True
 
     @message_handler
     async def handle_parking_found(self, message: ParkingFoundMessage, ctx: MessageContext) -> None:
-        self.assigned_spots = [
-            assigned_spot
-            for assigned_spot
-            in self.assigned_spots
-            if assigned_spot[0] != ctx.sender
-        ]
+        self._release(ctx.sender)
+
+        # las asignaciones que se solapan con el coche recién aparcado vuelven al principio de la cola
+        car_length = self.circuit.cars[int(ctx.sender.key)].length
         affected_assignments = [
-            assigned_spot
-            for assigned_spot
-            in self.assigned_spots
-            if collide(assigned_spot[1], message) and assigned_spot[0] != ctx.sender
+            sender
+            for sender in self.assigned_by_street.get(message.street_id, ())
+            if collide(self.assigned_spots[sender], message, car_length)
         ]
-        self.assigned_spots = [
-            assigned_spot
-            for assigned_spot
-            in self.assigned_spots
-            if assigned_spot not in affected_assignments
-        ]
-        self.requesters_queues += [
-            assigned_spot[0]
-            for assigned_spot
-            in affected_assignments
-        ]
-        self._assign_spots()
+        for sender in affected_assignments:
+            _, _, _, request = self._release(sender)
+            self.requesters_queue.appendleft((sender, *request))
+            self.reassignments += 1
+        self._pending = self._pending or len(affected_assignments) > 0
 
     @message_handler
     async def handle_parking_freed(self, message: ParkingFreedMessage, ctx: MessageContext) -> None:
-        self.known_spots.append(message)
-        self._assign_spots()
+        # el índice de aparcamiento ya recoge el hueco; solo hace falta volver a repartir
+        self._pending = True
+
+    async def on_tick(self):
+        self._drop_gone_cars()
+        if not self.requesters_queue:
+            return
+        if not self._pending and self._parking_version == self.circuit.parking.version:
+            return
+        await self._assign_spots()
+        self._pending = False
+        self._parking_version = self.circuit.parking.version
+
+    def stats(self):
+        return {
+            "assignments": self.assignments,
+            "reassignments": self.reassignments,
+            "waiting": len(self.requesters_queue),
+            "assigned": len(self.assigned_spots)
+        }
+
+    def close(self):
+        pass
+
+    async def _assign_spots(self):
+        parking = self.circuit.parking
+        reserved = self._reserved()
+        while self.requesters_queue:
+            sender, street_id, position = self.requesters_queue[0]
+            car = self.circuit.cars.get(int(sender.key))
+            coords = parking.position_coords(street_id, position) or self.circuit.street_coords.get(street_id)
+            if car is None or coords is None:
+                self.requesters_queue.popleft()
+                continue
+
+            spot = parking.nearest_free_spot(*coords, car.length, reserved)
+            if spot is None:
+                return
+            self.requesters_queue.popleft()
+
+            spot_street_id, spot_position = spot
+            self.assigned_spots[sender] = (spot_street_id, spot_position, car.length, (street_id, position))
+            self.assigned_by_street.setdefault(spot_street_id, set()).add(sender)
+            reserved.setdefault(spot_street_id, []).append((spot_position - car.length / 2, spot_position + car.length / 2))
+            self.assignments += 1
+            await self.send_message(ParkingAssignationMessage(spot_street_id, spot_position), sender)
 
-    def _assign_spots(self):
-        matches_n = min(len(self.known_spots), len(self.requesters_queues))
-        for i in range(matches_n):
-            recipient = self.requesters_queues[0]
-            spot = self.known_spots[0]
+    def _reserved(self):
+        reserved = {}
+        for street_id, senders in self.assigned_by_street.items():
+            reserved[street_id] = [
+                (position - length / 2, position + length / 2)
+                for _, position, length, _ in map(self.assigned_spots.get, senders)
+            ]
+        return reserved
 
-            recipient.send(ParkingAssignationMessage(spot.street_id, spot.position))
-            self.assigned_spots.append((recipient, spot))
+    def _release(self, sender):
+        assignment = self.assigned_spots.pop(sender, None)
+        if assignment is not None:
+            senders = self.assigned_by_street[assignment[0]]
+            senders.discard(sender)
+            if not senders:
+                del self.assigned_by_street[assignment[0]]
+        return assignment
 
-            self.requesters_queues = self.requesters_queues[1:]
-            self.known_spots = self.known_spots[1:]
+    def _drop_gone_cars(self):
+        gone = [sender for sender in self.assigned_spots if int(sender.key) not in self.circuit.cars]
+        for sender in gone:
+            self._release(sender)
 
 
-def collide(spot1, spot2):
-    return (
-            spot1.street_id == spot2.street_id
-            and abs(spot1.position - spot2.position) < 1
-    )
+def collide(assigned_spot, found, car_length):
+    street_id, position, length, _ = assigned_spot
+    return street_id == found.street_id and abs(position - found.position) < (length + car_length) / 2
@@ -1,45 +1,117 @@
-import heapq
-import math
+from concurrent.futures import ProcessPoolExecutor
 
 from autogen_core import RoutedAgent, message_handler, MessageContext
 
 from sma.agent.messages import PlanRequestMessage, PlanResponseMessage
+from sma.config import ROUTE_CACHE_SIZE, ROUTE_CACHE_OCCUPANCY_THRESHOLD, CONGESTION_EPOCH, PLANNER_WORKERS
 from sma.environment.circuit import Circuit
+from sma.environment.occupancy import occupancy_from_counts
+from sma.environment.routing import RouteCache, plan_batch, init_planning_worker, plan_batches_in_worker
 
 
 class PlannerAgent(RoutedAgent):
 
-    def __init__(self):
+    def __init__(self, circuit: Circuit, workers=PLANNER_WORKERS):
         super().__init__("planner")
-        self.circuit = Circuit.get_instance()
+        self.circuit = circuit
+        self.circuit.services["planner"] = self
+        self.route_cache = RouteCache(ROUTE_CACHE_SIZE, ROUTE_CACHE_OCCUPANCY_THRESHOLD)
+        self._requests = []  # (sender, start_street_id, end_street_id, instante de la petición) del subpaso
+        self._in_flight = []  # (future, [(goal_id, peticiones), ...], ocupación usada, época)
+        self._plans = 0
+        self._latency_sum = 0
+        self._latency_max = 0
+
+        self._workers = workers
+        self._executor = None
+        if workers > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=init_planning_worker,
+                initargs=(self.circuit.routing,)
+            )
 
     @message_handler
-    async def handle_message(self, message: PlanRequestMessage, _: MessageContext) -> PlanResponseMessage:
-        start = self.circuit.streets[message.start_street_id]
-        goal = self.circuit.streets[message.end_street_id]
-        return PlanResponseMessage(self._make_plan(start, goal))
-
-    def _make_plan(self, start, goal) -> list[int]:
-        open_set = [(0, start)]
-        came_from = {}
-        estimated_costs = {start.id: 0}
-
-        while open_set:
-            _, current = heapq.heappop(open_set)
-
-            if current == goal:
-                path = [current]
-                while current.id in came_from:
-                    current = came_from[current.id]
-                    path.append(current)
-
-                return list(reversed([street.id for street in path[:-1]]))
-
-            for neighbor in current.available_target_streets():
-                turn_cost = 0 if neighbor.orientation == current.orientation else 1
-                cars_on_street = len([car for car in self.circuit.cars.values() if car.street == neighbor])
-                estimated_cost = estimated_costs[current.id] + neighbor.length + cars_on_street + turn_cost
-                if estimated_cost < estimated_costs.get(neighbor.id, math.inf):
-                    came_from[neighbor.id] = current
-                    estimated_costs[neighbor.id] = estimated_cost
-                    heapq.heappush(open_set, (estimated_cost, neighbor))
+    async def handle_message(self, message: PlanRequestMessage, ctx: MessageContext) -> None:
+        self._requests.append((ctx.sender, message.start_street_id, message.end_street_id, self.circuit.time))
+
+    async def on_tick(self):
+        requests, self._requests = self._requests, []
+        occupancy = self.circuit.occupancy.count
+        epoch = int(self.circuit.time // CONGESTION_EPOCH)
+
+        requests_by_goal = {}
+        for request in requests:
+            _, start_id, goal_id, _ = request
+            plan = self.route_cache.get(start_id, goal_id, occupancy, epoch)
+            if plan is not None:
+                await self._respond(request, plan)
+            else:
+                requests_by_goal.setdefault(goal_id, []).append(request)
+
+        if self._executor is None:
+            for goal_id, goal_requests in requests_by_goal.items():
+                plans = plan_batch(self.circuit.routing, goal_id, self._start_ids(goal_requests), occupancy)
+                await self._deliver(goal_id, goal_requests, plans, occupancy, epoch)
+            return
+
+        if requests_by_goal:
+            # una tarea por proceso con un reparto de los destinos, así la ocupación se envía una vez a cada uno
+            occupancy_counts = self.circuit.occupancy.counts()
+            goals = list(requests_by_goal.items())
+            for worker in range(min(self._workers, len(goals))):
+                chunk = goals[worker::self._workers]
+                future = self._executor.submit(
+                    plan_batches_in_worker,
+                    [(goal_id, self._start_ids(goal_requests)) for goal_id, goal_requests in chunk],
+                    occupancy_counts
+                )
+                self._in_flight.append((future, chunk, occupancy_counts, epoch))
+
+        # la simulación sigue avanzando: sólo se entregan los planes que ya han terminado
+        in_flight, self._in_flight = self._in_flight, []
+        for batch in in_flight:
+            future, chunk, occupancy_counts, batch_epoch = batch
+            if future.done():
+                occupancy = occupancy_from_counts(occupancy_counts)
+                for (goal_id, goal_requests), plans in zip(chunk, future.result()):
+                    await self._deliver(goal_id, goal_requests, plans, occupancy, batch_epoch)
+            else:
+                self._in_flight.append(batch)
+
+    def stats(self):
+        return {
+            "route_cache": self.route_cache.stats(),
+            "plan_latency": {
+                "plans": self._plans,
+                "in_flight": sum(len(goal_requests) for batch in self._in_flight for _, goal_requests in batch[1]),
+                "average": self._latency_sum / self._plans if self._plans else 0,
+                "max": self._latency_max
+            }
+        }
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _start_ids(requests):
+        return sorted({start_id for _, start_id, _, _ in requests})
+
+    async def _deliver(self, goal_id, requests, plans, occupancy, epoch):
+        for start_id, plan in plans.items():
+            self.route_cache.put(start_id, goal_id, plan, occupancy, epoch)
+        for request in requests:
+            await self._respond(request, plans[request[1]])
+
+    async def _respond(self, request, plan):
+        sender, _, _, requested_at = request
+        latency = self.circuit.time - requested_at
+        self._plans += 1
+        self._latency_sum += latency
+        self._latency_max = max(self._latency_max, latency)
+        # un plan vacío indica que no hay ruta (o que ya se está en el destino)
+        await self.send_message(PlanResponseMessage(plan or []), sender)
+
+    def _make_plan(self, start, goal) -> list[int] | None:
+        return plan_batch(self.circuit.routing, goal.id, [start.id], self.circuit.occupancy.count)[start.id]
@@ -1,9 +1,21 @@
 UNPARK_PROBABILITY = 0.0003
 MAX_CARS = 200
+SPAWN_PROBABILITY = 0.3  # probabilidad de que aparezca un coche en cada subpaso
 SIMULATION_DELTA = 2 / 30
 SECONDS = 60 * 5
+ROUTING_LANDMARKS = 8  # landmarks precalculados para la heurística ALT del planificador
+ROUTE_CACHE_SIZE = 1024  # rutas guardadas en la caché LRU del planificador
+ROUTE_CACHE_OCCUPANCY_THRESHOLD = 2  # cambio de coches a lo largo de una ruta a partir del cual se recalcula
+CONGESTION_EPOCH = 10  # segundos tras los que se descartan todas las rutas guardadas
+PLANNER_WORKERS = 0  # procesos para planificar fuera del bucle de la simulación (0 para planificar en el bucle)
+MESSAGE_TRANSPORT = "autogen"  # transporte de los mensajes entre agentes: "autogen" o "direct" (sma/agent/bus.py)
+HISTORY_BUFFER_SIZE = 15  # snapshots que se acumulan antes de escribirlos en el histórico en disco
+HISTORY_KEYFRAME_INTERVAL = 150  # snapshots entre dos keyframes del histórico (0 para guardar siempre el estado completo)
 
 SECONDS_PRE_SIMULATION = 60 * 2
 PIXELS_PER_UNIT = 50  # escala de longitud en píxeles por unidad de longitud de calle
 MARGIN = 60  # margen de la ventana en píxeles
 PERIOD = 1 / 30  # segundos entre cada actualización de la pantalla
+ZOOM_LEVELS = (0.1, 0.2, 0.35, 0.5, 0.75, 1, 1.5, 2, 3)  # factores de zoom de la ventana, el 1 es el inicial
+TILE_SIZE = 256  # lado en píxeles de las teselas en que se dibuja el mapa
+TILE_CACHE_SIZE = 512  # teselas dibujadas que se guardan para reutilizarlas al mover o cambiar el zoom
@@ -0,0 +1,28 @@
+import heapq
+
+
+# conductores que deben actuar en cada subpaso: los despiertan eventos de su coche, mensajes o alarmas
+class ActivationScheduler:
+
+    def __init__(self):
+        self.tick = 0
+        self._awake = set()
+        self._alarms = []  # (tick, car_id)
+
+    def __len__(self):
+        return len(self._awake)
+
+    def wake(self, car_id):
+        self._awake.add(car_id)
+
+    def wake_at(self, car_id, tick):
+        heapq.heappush(self._alarms, (tick, car_id))
+
+    def due(self):
+        self.tick += 1
+        while self._alarms and self._alarms[0][0] <= self.tick:
+            self._awake.add(heapq.heappop(self._alarms)[1])
+
+        awake = sorted(self._awake)
+        self._awake = set()
+        return awake
@@ -2,7 +2,7 @@ import logging
 from dataclasses import dataclass
 
 from sma.environment.street import Street, Parking
-from sma.environment.trafficlight import TrafficLight, TrafficColor
+from sma.environment.trafficlight import TrafficColor
 
 
 @dataclass
@@ -37,24 +37,30 @@ class Car:
             if circuit.has_car_ahead(self):
                 self.stop()
             elif self.is_at_end():
-                stoppers = [
-                    element
-                    for element in self.street.elements_at_end
-                    if isinstance(element, TrafficLight) and element.color == TrafficColor.RED
-                ]
-                if len(stoppers) == 0:
-                    self.is_blocked = not self._try_take_next_street(circuit)
-                else:
-                    self.stop()
-
-            self.position = (
-                self.street,
-                self.position[1] + self._linear_speed * delta
-            )
+                circuit.street_transition(self)
+
+            if self._linear_speed != 0:
+                self._move_to((
+                    self.street,
+                    self.position[1] + self._linear_speed * delta
+                ), circuit)
+            if self.is_at_end():
+                circuit.wake_driver(self)
 
     def is_at_end(self):
         return self.street.length - self.position[1] < 0
 
+    def reach_end(self, circuit):
+        stoppers = [
+            light
+            for light in circuit.signals_at_end[self.street.id]
+            if light.color == TrafficColor.RED
+        ]
+        if len(stoppers) == 0:
+            self.is_blocked = not self._try_take_next_street(circuit)
+        else:
+            self.stop()
+
     def _try_take_next_street(self, circuit) -> bool:
         if self.target_street is None:
             self.stop()
@@ -72,7 +78,7 @@ class Car:
 
             self.target_street = None
             if (circuit.fits_car_at(self.target_street, target_position[1], self.length)):
-                self.position = target_position
+                self._move_to(target_position, circuit)
                 return True
             else:
                 self.stop()
@@ -88,24 +94,25 @@ class Car:
 
         if self.can_park(circuit):
             self.stop()
-            self.position = (self.street.parking, self.position[1])
+            self._move_to((self.street.parking, self.position[1]), circuit)
 
     def unpark(self, circuit) -> bool:
         if not self.is_parked():
             logging.info(f"Car {self.id} is not parked")
             return False
 
-        street = next(
-            street
-            for street in circuit.streets.values()
-            if self.position[0] == street.parking
-        )
+        # el aparcamiento tiene el id de su calle
+        street = circuit.streets[self.position[0].id]
         if circuit.fits_car_at(street, self.position[1], self.length):
-            self.position = (street, self.position[1])
+            self._move_to((street, self.position[1]), circuit)
             return True
         else:
             return False
 
+    def _move_to(self, position, circuit):
+        self.position = position
+        circuit.on_car_moved(self)
+
     def stop(self):
         self._linear_speed = 0
 
@@ -0,0 +1,14 @@
+# lo que ha cambiado en el circuito desde el último snapshot, para guardar sólo las diferencias en el histórico
+class ChangeTracker:
+
+    def __init__(self):
+        self.moved = set()  # ids de coches que han cambiado de posición o han aparecido
+        self.removed = set()  # ids de coches borrados
+        self.drivers = set()  # ids de coches cuyo conductor ha actuado
+        self.signals = []  # semáforos y pasos de peatones que han cambiado de color
+
+    def clear(self):
+        self.moved = set()
+        self.removed = set()
+        self.drivers = set()
+        self.signals = []
@@ -1,17 +1,27 @@
 import logging
 import random
 from dataclasses import dataclass
-from functools import cached_property
+from time import perf_counter
 
+import numpy as np
 from autogen_core import AgentId
 
+from sma.agent.bus import DirectMessageBus
+from sma.agent.instrumentation import MessageStats
 from sma.agent.messages import CarAssignationMessage
-from sma.config import MAX_CARS
+from sma.config import MAX_CARS, SPAWN_PROBABILITY, UNPARK_PROBABILITY, HISTORY_KEYFRAME_INTERVAL
+from sma.environment.activation import ActivationScheduler
 from sma.environment.car import Car
-from sma.environment.street import Street, Orientation, StreetExtremity
-from sma.environment.trafficlight import TrafficLight, TrafficColor
+from sma.environment.changes import ChangeTracker
+from sma.environment.circuitmap import CircuitMap
+from sma.environment.kinematics import KinematicsEngine
+from sma.environment.lanes import LaneIndex
+from sma.environment.occupancy import StreetOccupancy
+from sma.environment.parking import ParkingIndex
+from sma.environment.street import Street
+from sma.environment.timing import PhaseTimer
+from sma.environment.trafficlight import TrafficLight, TrafficColor, TrafficLightScheduler, SignalTracks
 
-STREET_UNITS_WIDTH = 0.5
 FIXED_DELTA = 1 / 60
 
 
@@ -24,6 +34,33 @@ class SimulationSnapshot:
     cars_color: dict[int, int]
 
 
+# diferencias respecto al snapshot anterior; un keyframe contiene el estado completo de los coches, y los colores de
+# semáforos y pasos de peatones son sólo los que acaban de cambiar (el resto sale de SimulationHistory.signal_tracks)
+@dataclass
+class SnapshotDelta:
+    keyframe: bool
+    traffic_lights: dict[int, TrafficColor]
+    walkways: dict[int, TrafficColor]
+    cars_coords: dict[int, tuple[float, float]]
+    cars_parked: set[int]
+    cars_unparked: set[int]
+    cars_color: dict[int, int]
+    cars_removed: set[int]
+
+    @classmethod
+    def from_snapshot(cls, snapshot: SimulationSnapshot):
+        return cls(
+            keyframe=True,
+            traffic_lights=dict(snapshot.traffic_lights),
+            walkways=dict(snapshot.walkways),
+            cars_coords=dict(snapshot.cars_coords),
+            cars_parked=set(snapshot.cars_parked or ()),
+            cars_unparked=set(),
+            cars_color=dict(snapshot.cars_color),
+            cars_removed=set()
+        )
+
+
 @dataclass
 class SimulationHistory:
     streets: dict[int, Street]
@@ -32,278 +69,247 @@ class SimulationHistory:
     street_coords: dict[int, tuple[float, float]]
     history: list[SimulationSnapshot]
     graphic_hints: dict[int, str]
+    signal_tracks: SignalTracks | None = None
     stats = {}
 
 
 class Circuit:
 
-    def __init__(
-            self,
-            streets: dict[int, Street],
-            entry_points: set[int],
-            traffic_lights: dict[int, TrafficLight],
-            walkways: dict[int, TrafficLight],
-            cars: dict[int, Car],
-            graphic_hints: dict[int, str]
-    ):
-        self.streets = streets
-        self.entry_points = entry_points
-        self.traffic_lights = traffic_lights
-        self.walkways = walkways
-        self.cars = cars
-        self.graphic_hints = graphic_hints
+    def __init__(self, circuit_map: CircuitMap, rng=random):
+        # rng es el generador de números aleatorios de este circuito y sus agentes; por defecto el del módulo random,
+        # y uno propio (random.Random(seed)) para que varias simulaciones del mismo proceso no dependan entre sí
+        self.map = circuit_map
+        self.random = rng
+        self.streets = circuit_map.streets
+        self.routing = circuit_map.routing
+        self.entry_points = circuit_map.entry_points
+        self.traffic_lights = {id_: TrafficLight.random(id_, rng) for id_ in circuit_map.traffic_light_ids}
+        self.walkways = {id_: TrafficLight.random(id_, rng) for id_ in circuit_map.walkway_ids}
+        self.signals = TrafficLightScheduler([*self.traffic_lights.values(), *self.walkways.values()])
+        self.signals_at_end = {
+            street_id: [self.walkways[ref.id] if ref.walkway else self.traffic_lights[ref.id] for ref in refs]
+            for street_id, refs in circuit_map.signals_at_end.items()
+        }
+        self.cars = {}
+        self.graphic_hints = circuit_map.graphic_hints
+        self.lanes = LaneIndex()
+        self.occupancy = StreetOccupancy(self.streets)
+        self.parking = ParkingIndex(self.streets, self.street_coords)
+        self.kinematics = None
+        self._lane_rows = None
+        self.timer = None
+        self.message_stats = None
         self._car_counter = 0
         self.agent_runtime = None
+        self.message_bus = None
         self.history = SimulationHistory(
-            streets,
+            self.streets,
             self.traffic_light_coords,
             self.walkway_coords,
             {},
             [],
-            graphic_hints
+            self.graphic_hints
         )
+        self.history_writer = None
+        self.changes = None
+        self.keyframe_interval = 0
+        self._snapshots_taken = 0
+        self._snapshot_parked = set()
+        self._snapshot_states = {}
         self.drivers = {}
+        self.services = {}
+        self.activations = ActivationScheduler()
         self.time = 0
 
+        # parámetros de la ejecución, por defecto los de sma/config.py
+        self.max_cars = MAX_CARS
+        self.spawn_probability = SPAWN_PROBABILITY
+        self.unpark_probability = UNPARK_PROBABILITY
+
     def set_agent_runtime(self, agent_runtime):
         self.agent_runtime = agent_runtime
+        # con el bus directo los mensajes se entregan en step, antes y después del on_tick de los servicios
+        self.message_bus = agent_runtime if isinstance(agent_runtime, DirectMessageBus) else None
         logging.info(f"Agent runtime set")
 
-    @classmethod
-    def load_json(cls, data):
-        entry_points = set()
-        graphic_hints = {}
-        for street_obj in data:
-            street_obj["orientation"] = Orientation[street_obj["orientation"]]
-            if street_obj.get("is_entry_point", False):
-                entry_points.add(street_obj["id"])
-                del street_obj["is_entry_point"]
-
-            if street_graphic_hints := street_obj.get("graphic_hint"):
-                graphic_hints[street_obj["id"]] = street_graphic_hints
-                del street_obj["graphic_hint"]
-
-        streets = {
-            street["id"]: Street(**street)
-            for street in data
-        }
-
-        references = set(sum([street["elements_at_end"] for street in data], []))
-
-        traffic_lights = {
-            id_: TrafficLight.random(id_)
-            for id_
-            in [
-                int(ref.split(" ")[1])
-                for ref
-                in references
-                if ref.startswith("@traffic_light")
-            ]
-        }
-
-        walkways = {
-            id_: TrafficLight.random(id_)
-            for id_
-            in [
-                int(ref.split(" ")[1])
-                for ref
-                in references
-                if ref.startswith("@walkway")
-            ]
-        }
-
-        logging.info(f"streets loaded: {len(streets)}")
-        logging.info(f"    with graphic hints: {len(graphic_hints)}")
-        logging.info(f"traffic lights: {len(traffic_lights)}")
-        logging.info(f"walkways: {len(walkways)}")
-
-        logging.info("Resolving references...")
-        resolvers_catalog = {
-            "@traffic_light": lambda _id: traffic_lights[_id],
-            "@walkway": lambda _id: walkways[_id],
-            "@street_start": lambda _id: streets[_id].start,
-            "@street_end": lambda _id: streets[_id].end,
-            "@end": lambda _id: f"@end {_id}"
-        }
-
-        for street in streets.values():
-            if street.parallel_street is not None:
-                street.parallel_street = streets[street.parallel_street]
-
-            resolved_elements = []
-            for element in street.elements_at_end:
-                ref_parts = element.split(" ")
-                catalog = resolvers_catalog.get(ref_parts[0])
-                if catalog is not None:
-                    resolved_elements.append(
-                        catalog(int(ref_parts[1]))
-                    )
-
-            street.elements_at_end = resolved_elements
-
-        circuit_holder.append(
-            cls(
-                streets=streets,
-                traffic_lights=traffic_lights,
-                walkways=walkways,
-                cars={},
-                entry_points=entry_points,
-                graphic_hints=graphic_hints
-            )
-        )
+    def set_history_writer(self, history_writer, keyframe_interval=HISTORY_KEYFRAME_INTERVAL):
+        # los snapshots se escriben en disco a medida que se toman en lugar de acumularse en memoria; con un intervalo
+        # de keyframes se escriben sólo los cambios entre snapshots y el estado completo cada keyframe_interval (con 0,
+        # siempre el estado completo). Los semáforos se guardan como su color actual más los cambios de color
+        self.history_writer = history_writer
+        self.keyframe_interval = keyframe_interval
+        self.changes = ChangeTracker()
+        self.history.signal_tracks = SignalTracks.starting_from(self.traffic_lights, self.walkways)
+        history_writer.write_header(self.get_history())
+
+    def enable_kinematics_engine(self):
+        if self.cars:
+            raise RuntimeError("The kinematics engine must be enabled before spawning cars")
+        self.kinematics = KinematicsEngine(self.streets)
+        self.lanes = self.kinematics
+        # fila de StreetLayout de cada carril del motor (un aparcamiento tiene el id de su calle)
+        self._lane_rows = np.array([self.map.layout.rows[lane.id] for lane in self.kinematics.lanes], dtype=np.intp)
+        if self.timer is not None:
+            self.kinematics._cars_ahead = self.timer.timed("has_car_ahead", self.kinematics._cars_ahead)
+        logging.info(f"Kinematics engine enabled")
+
+    def enable_phase_timing(self, profile_steps=None, profile_output=None):
+        # has_car_ahead, fits_car_at y los cambios de calle se llaman coche a coche, así que se sustituyen en esta
+        # instancia por versiones cronometradas en lugar de comprobar el temporizador en cada llamada. Su tiempo también
+        # cuenta en la fase desde la que se llaman (cars, activation, spawning...)
+        self.timer = PhaseTimer(profile_steps, profile_output)
+        self.services["phases"] = self.timer
+        for name in ("has_car_ahead", "fits_car_at", "street_transition"):
+            setattr(self, name, self.timer.timed(name, getattr(self, name)))
+        if self.kinematics is not None:
+            # el motor vectorizado calcula los coches con otro delante para toda la flota a la vez
+            self.kinematics._cars_ahead = self.timer.timed("has_car_ahead", self.kinematics._cars_ahead)
+        logging.info(f"Phase timing enabled")
+
+    def enable_message_stats(self):
+        # simulation() engancha las estadísticas al runtime y a los agentes que crea para este circuito
+        if self.agent_runtime is not None:
+            raise RuntimeError("Message stats must be enabled before the agent runtime is set")
+        self.message_stats = MessageStats(self)
+        self.services["messages"] = self.message_stats
+        logging.info(f"Message stats enabled")
 
-    @staticmethod
-    def get_instance():
-        return circuit_holder[0]
+    @classmethod
+    def load_json(cls, data, rng=random):
+        return cls(CircuitMap.load_json(data), rng)
 
-    @cached_property
+    @property
     def street_coords(self):
-        logging.info("Computing street coordinates...")
-        street_coords = {}  # street.id -> (x, y)
-        visited = set()
-
-        start_street = self.streets[1]
-        queue = [(start_street, (0, 0))]
-        street_coords[start_street.id] = (0, 0)
-
-        while queue:
-            current, (x, y) = queue.pop(0)
-            if current.id in visited:
-                continue
-            visited.add(current.id)
-
-            street_coords[current.id] = (x, y)
-
-            dx, dy = current.orientation.value
-            end_x = x + dx * current.length
-            end_y = y + dy * current.length
-
-            for element in current.elements_at_end:
-                match element:
-                    case (Street, StreetExtremity.START):
-                        queue.append((element[0], (end_x, end_y)))
-                    case (Street, StreetExtremity.END):
-                        dx, dy = element[0].orientation.value
-                        start_x = end_x - dx * element[0].length
-                        start_y = end_y - dy * element[0].length
-                        queue.append((element[0], (start_x, start_y)))
-
-            if current.parallel_street is not None:
-                hints_of_parallel = [
-                    hint
-                    for hint
-                    in self.graphic_hints.get(current.id, [])
-                    if hint.startswith("PARALLEL")
-                ]
-                if len(hints_of_parallel) == 1:
-                    offset_direction = Orientation[
-                        hints_of_parallel[0].split(" ")[1]
-                    ]
-
-                    dx, dy = offset_direction.value
-                    queue.append((current.parallel_street, (x + dx * STREET_UNITS_WIDTH, y + dy * STREET_UNITS_WIDTH)))
-        return street_coords
-
-    def _final_element_coords(self, collection):
-        elements_coords = {}
-        for element in collection:
-            street = next(street for street in self.streets.values() if element in street.elements_at_end)
-            start_x, start_y = self.street_coords[street.id]
-            dx, dy = street.orientation.value
-            elements_coords[element.id] = (
-                start_x + dx * (street.length - 0.5),  # quitar una unidad para que se quede en la calle
-                start_y + dy * (street.length - 0.5)
-            )
-        return elements_coords
-
-    def car_coords(self):
-        car_coords = {}
-        for car in self.cars.values():
-            street = car.position[0]
-            start_x, start_y = self.street_coords[street.id]
-            dx, dy = street.orientation.value
-
-            car_coords[car.id] = (
-                start_x + dx * (car.position[1]),  # quitar una unidad para que se quede en la calle
-                start_y + dy * (car.position[1])
-            )
-            if car.is_parked():
-                perp_x, perp_y = dy, -dx
-                if "PARKING LEFT" in self.graphic_hints.get(street.id, {}):
-                    perp_x *= -1
-                    perp_y *= -1
-                parking_offset_x = perp_x * STREET_UNITS_WIDTH if car.is_parked() else 0
-                parking_offset_y = perp_y * STREET_UNITS_WIDTH if car.is_parked() else 0
-                car_coords[car.id] = (
-                    car_coords[car.id][0] + parking_offset_x,
-                    car_coords[car.id][1] + parking_offset_y
-                )
-        return car_coords
+        return self.map.street_coords
 
-    @cached_property
+    @property
     def traffic_light_coords(self):
-        return self._final_element_coords(self.traffic_lights.values())
+        return self.map.traffic_light_coords
 
-    @cached_property
+    @property
     def walkway_coords(self):
-        return self._final_element_coords(self.walkways.values())
+        return self.map.walkway_coords
+
+    def car_coords(self, cars=None):
+        # coordenadas del mundo de los coches (por defecto todos), con una sola operación sobre la transformación de
+        # cada calle en lugar de calcularlas coche a coche
+        cars = list(self.cars.values()) if cars is None else cars
+        if not cars:
+            return {}
+        layout = self.map.layout
+        if self.kinematics is not None:
+            lanes, offsets, parked = self.kinematics.positions(cars)
+            rows = self._lane_rows[lanes]
+        else:
+            rows = np.fromiter((layout.rows[car.position[0].id] for car in cars), dtype=np.intp, count=len(cars))
+            offsets = np.fromiter((car.position[1] for car in cars), dtype=np.float64, count=len(cars))
+            parked = np.fromiter((car.is_parked() for car in cars), dtype=bool, count=len(cars))
+        points = layout.coords(rows, offsets, parked)
+        return dict(zip((car.id for car in cars), zip(points[:, 0].tolist(), points[:, 1].tolist())))
+
+    def on_car_moved(self, car):
+        if self.kinematics is None:
+            # los CarView del motor escriben su posición directamente en los arrays
+            self.lanes.update(car)
+        self.occupancy.update(car)
+        self.parking.update(car)
+        if self.changes is not None:
+            self.changes.moved.add(car.id)
+
+    def cars_on_street(self, street):
+        return self.occupancy.count(street.id)
+
+    def street_density(self, street):
+        return self.occupancy.density(street.id)
+
+    def wake_driver(self, car):
+        self.activations.wake(car.id)
 
     def has_car_ahead(self, car, safe_distance=0.05):
-        for other in self.cars.values():
-            if other == car or other.street != car.street:
-                continue
-
-            front_other = other.position[1] + other.length / 2
-            rear_other = other.position[1] - other.length / 2
-            front_car = car.position[1] + car.length / 2
-            # if rear_other > front_car and rear_other - front_car < safe_distance:
-            if front_car < front_other and rear_other - front_car < safe_distance:
-                return True
-        return False
+        return self.lanes.has_car_ahead(car, safe_distance)
 
     def fits_car_at(self, street, point, car_length):
-        front = point + car_length / 2
-        rear = point - car_length / 2
-
-        for other in self.cars.values():
-            if other.street != street:
-                continue
-            other_front = other.position[1] + other.length / 2
-            other_rear = other.position[1] - other.length / 2
+        return self.lanes.fits_car_at(street, point, car_length)
 
-            if front >= other_rear and rear <= other_front:
-                return False
-        return True
+    def street_transition(self, car):
+        car.reach_end(self)
 
     async def step(self, total_delta):
+        timer = self.timer
+        if timer is not None:
+            timer.begin_step()
         while total_delta > 0:
             delta = min(total_delta, FIXED_DELTA)
             total_delta -= delta
-
-            for traffic_light in self.traffic_lights.values():
-                traffic_light.step(delta)
-
-            for walkway in self.walkways.values():
-                walkway.step(delta)
-
-            for car in self.cars.values():
-                if not car.marked_for_deletion:
-                    car.step(delta, self)
-
-            self.cars = {
-                id_: car
-                for id_, car in self.cars.items()
-                if not car.marked_for_deletion
-            }
-
-            spawn_probability = 0.3
-            if len(self.cars) < MAX_CARS and random.random() < spawn_probability:
+            mark = perf_counter() if timer is not None else None
+
+            switched = self.signals.advance(delta)
+            if self.changes is not None:
+                self.changes.signals += switched
+            if timer is not None:
+                mark = timer.lap("signals", mark)
+
+            if self.kinematics is not None:
+                self.kinematics.step(delta, self)
+            else:
+                for car in self.cars.values():
+                    if not car.marked_for_deletion:
+                        car.step(delta, self)
+            if timer is not None:
+                mark = timer.lap("cars", mark)
+
+            self._delete_marked_cars()
+            if timer is not None:
+                mark = timer.lap("deletion", mark)
+
+            if len(self.cars) < self.max_cars and self.random.random() < self.spawn_probability:
                 await self.spawn_car()
-
-            for agent in self.drivers.values():
+                if self.message_bus is not None:
+                    # como con autogen, el conductor recibe su coche y actúa en este mismo subpaso
+                    await self.message_bus.deliver()
+            if timer is not None:
+                mark = timer.lap("spawning", mark)
+
+            for car_id in self.activations.due():
+                agent = self.drivers.get(car_id)
+                if agent is None:
+                    continue
                 await agent.act()
+                if self.changes is not None:
+                    self.changes.drivers.add(car_id)
+                if agent.needs_activation():
+                    self.activations.wake(car_id)
+            if timer is not None:
+                mark = timer.lap("activation", mark)
+
+            if self.message_bus is not None:
+                await self.message_bus.deliver()
+                if timer is not None:
+                    mark = timer.lap("delivery", mark)
+
+            for service in list(self.services.values()):
+                await service.on_tick()
+            if timer is not None:
+                mark = timer.lap("services", mark)
+
+            if self.message_bus is not None:
+                await self.message_bus.deliver()
+                if timer is not None:
+                    timer.lap("delivery", mark)
 
             self.time += delta
+        if timer is not None:
+            timer.end_step()
+
+    def _delete_marked_cars(self):
+        deleted = [car for car in self.cars.values() if car.marked_for_deletion]
+        for car in deleted:
+            self.lanes.remove(car)
+            self.occupancy.remove(car)
+            self.parking.remove(car)
+            del self.cars[car.id]
+            if self.changes is not None:
+                self.changes.removed.add(car.id)
 
     def finish(self):
         total_parked = len([agent for agent in self.drivers.values() if agent.achieved_parking])
@@ -316,17 +322,24 @@ class Circuit:
                 for agent
                 in self.drivers.values()
                 if agent.achieved_parking
-            ) / total_parked
+            ) / total_parked if total_parked else None
         }
+        for name, service in self.services.items():
+            self.history.stats[name] = service.stats()
+            service.close()
+        if self.message_bus is not None:
+            self.history.stats["bus"] = self.message_bus.stats()
+        if self.history_writer is not None:
+            self.history_writer.close(self.history.stats)
 
     async def spawn_car(self):
         shuffled_entry_points = [self.streets[entry_point] for entry_point in self.entry_points]
-        random.shuffle(shuffled_entry_points)
+        self.random.shuffle(shuffled_entry_points)
 
         car_length = 1
         for entry_point in shuffled_entry_points:
             if self.fits_car_at(entry_point, 0, car_length):
-                car = Car(
+                car = self._new_car(
                     id=self._car_counter,
                     position=(entry_point, 0.0),
                     max_linear_speed=1,
@@ -334,6 +347,7 @@ class Circuit:
                     length=car_length
                 )
                 self.cars[car.id] = car
+                self.on_car_moved(car)
 
                 await self.agent_runtime.send_message(
                     CarAssignationMessage(car.id),
@@ -343,30 +357,100 @@ class Circuit:
 
                 break
 
+    def _new_car(self, **kwargs):
+        if self.kinematics is not None:
+            return self.kinematics.create_car(**kwargs)
+        return Car(**kwargs)
+
     def get_history(self):
         self.history.street_coords = self.street_coords
         return self.history
 
     def take_snapshot(self):
-        self.history.history.append(
-            SimulationSnapshot(
-                traffic_lights={
-                    id_: traffic_light.color
-                    for id_, traffic_light in self.traffic_lights.items()
-                },
-                walkways={
-                    id_: walkway.color
-                    for id_, walkway in self.walkways.items()
-                },
-                cars_coords=self.car_coords(),
-                cars_parked=set(car.id for car in self.cars.values() if car.is_parked()),
-                cars_color={
-                    agent.car.id: agent.state
-                    for agent in self.drivers.values()
-                    if agent.car is not None and not agent.car.marked_for_deletion
-                }
-            )
+        start = perf_counter() if self.timer is not None else None
+        if self.history_writer is not None:
+            self.history_writer.write_delta(self._snapshot_delta())
+        else:
+            self.history.history.append(self._full_snapshot())
+        if self.timer is not None:
+            self.timer.lap("snapshot", start)
+
+    def _full_snapshot(self, signals=True):
+        return SimulationSnapshot(
+            traffic_lights={
+                id_: traffic_light.color
+                for id_, traffic_light in self.traffic_lights.items()
+            } if signals else {},
+            walkways={
+                id_: walkway.color
+                for id_, walkway in self.walkways.items()
+            } if signals else {},
+            cars_coords=self.car_coords(),
+            cars_parked=set(car.id for car in self.cars.values() if car.is_parked()),
+            cars_color={
+                agent.car.id: agent.state
+                for agent in self.drivers.values()
+                if agent.car is not None and not agent.car.marked_for_deletion
+            }
+        )
+
+    def _snapshot_delta(self):
+        keyframe = self.keyframe_interval <= 0 or self._snapshots_taken % self.keyframe_interval == 0
+        self._snapshots_taken += 1
+        if keyframe:
+            delta = SnapshotDelta.from_snapshot(self._full_snapshot(signals=False))
+            self._snapshot_parked = set(delta.cars_parked)
+            self._snapshot_states = dict(delta.cars_color)
+            self._add_switched_signals(delta)
+            self.changes.clear()
+            if self.kinematics is not None:
+                self.kinematics.pop_moved()
+            return delta
+
+        moved = self.changes.moved
+        if self.kinematics is not None:
+            moved.update(self.kinematics.pop_moved())
+        delta = SnapshotDelta(
+            keyframe=False,
+            traffic_lights={},
+            walkways={},
+            cars_coords={},
+            cars_parked=set(),
+            cars_unparked=set(),
+            cars_color={},
+            cars_removed=self.changes.removed
         )
+        for car_id in delta.cars_removed:
+            self._snapshot_parked.discard(car_id)
+            self._snapshot_states.pop(car_id, None)
+
+        moved_cars = [self.cars[car_id] for car_id in sorted(moved) if car_id in self.cars]
+        delta.cars_coords = self.car_coords(moved_cars)
+        for car in moved_cars:
+            car_id = car.id
+            if car.is_parked() and car_id not in self._snapshot_parked:
+                delta.cars_parked.add(car_id)
+                self._snapshot_parked.add(car_id)
+            elif not car.is_parked() and car_id in self._snapshot_parked:
+                delta.cars_unparked.add(car_id)
+                self._snapshot_parked.discard(car_id)
+
+        for car_id in sorted(self.changes.drivers | delta.cars_coords.keys()):
+            agent = self.drivers.get(car_id)
+            if agent is None or agent.car is None or agent.car.marked_for_deletion:
+                continue
+            if self._snapshot_states.get(car_id) != agent.state:
+                delta.cars_color[car_id] = agent.state
+                self._snapshot_states[car_id] = agent.state
+
+        self._add_switched_signals(delta)
+        self.changes.clear()
+        return delta
 
+    def _add_switched_signals(self, delta):
+        for light in self.changes.signals:
+            if self.traffic_lights.get(light.id) is light:
+                delta.traffic_lights[light.id] = light.color
+            else:
+                delta.walkways[light.id] = light.color
 
-circuit_holder = []
@@ -0,0 +1,300 @@
+import gc
+import logging
+import os
+import pickle
+from collections import deque
+from functools import cached_property
+
+from sma.config import ROUTING_LANDMARKS
+from sma.environment.layout import StreetLayout
+from sma.environment.mapfile import read_street_records
+from sma.environment.routing import StreetGraph
+from sma.environment.street import Street, Orientation, StreetExtremity
+from sma.environment.trafficlight import SignalRef
+
+STREET_UNITS_WIDTH = 0.5
+# el mapa compilado se guarda junto al JSON (soho_map.json -> soho_map.json.compiled); la versión cambia cuando cambia lo
+# que se guarda en él
+COMPILED_MAP_SUFFIX = ".compiled"
+COMPILED_MAP_VERSION = 3
+
+
+_ORIENTATIONS = list(Orientation)
+
+
+def _extremity(street, extremity):
+    return street.start if extremity == StreetExtremity.START.value else street.end
+
+
+# mapa compilado: calles con las referencias resueltas, grafo de rutas y geometría. No cambia durante la simulación, así
+# que varios circuitos pueden compartirlo; los semáforos, coches y agentes son de cada circuito
+class CircuitMap:
+
+    def __init__(
+            self,
+            streets: dict[int, Street],
+            entry_points: set[int],
+            traffic_light_ids: list[int],
+            walkway_ids: list[int],
+            graphic_hints: dict[int, str]
+    ):
+        self.streets = streets
+        self.entry_points = entry_points
+        self.traffic_light_ids = traffic_light_ids
+        self.walkway_ids = walkway_ids
+        self.graphic_hints = graphic_hints
+        self.routing = StreetGraph(streets, landmarks=ROUTING_LANDMARKS)
+        self.signals_at_end = {
+            street.id: [element for element in street.elements_at_end if isinstance(element, SignalRef)]
+            for street in streets.values()
+        }
+        # calle de cada semáforo o paso de peatones; si lo comparten varias (una calle y su paralela) vale la primera
+        self.signal_streets = {}
+        for street_id, refs in self.signals_at_end.items():
+            for signal in refs:
+                self.signal_streets.setdefault(signal, street_id)
+        self.exit_streets = [
+            street
+            for street in streets.values()
+            if any(type(element) == str and element.startswith("@end") for element in street.elements_at_end)
+        ]
+
+    @classmethod
+    def load(cls, path):
+        # carga el mapa compilado si existe y corresponde al JSON actual (mismo tamaño y fecha de modificación); si no,
+        # compila el JSON y lo guarda para la próxima vez
+        compiled_path = path + COMPILED_MAP_SUFFIX
+        source = os.stat(path)
+        key = (COMPILED_MAP_VERSION, source.st_size, source.st_mtime_ns)
+        try:
+            with open(compiled_path, "rb") as f:
+                if pickle.load(f) == key:
+                    # se crean cientos de miles de objetos que no se liberan: el recolector sólo añadiría pasadas inútiles
+                    gc.disable()
+                    try:
+                        circuit_map = pickle.load(f)
+                    finally:
+                        gc.enable()
+                    logging.info(f"Compiled map loaded from {compiled_path}")
+                    return circuit_map
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # fichero a medias o de otra versión del código: se vuelve a compilar
+            logging.warning(f"Discarding compiled map {compiled_path}: {e!r}")
+
+        circuit_map = cls.load_records(read_street_records(path))
+        circuit_map.compile()
+        try:
+            # se escribe aparte y se renombra para que otro proceso nunca lea un fichero a medias
+            temporary_path = f"{compiled_path}.{os.getpid()}"
+            with open(temporary_path, "wb") as f:
+                pickle.dump(key, f)
+                pickle.dump(circuit_map, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, compiled_path)
+            logging.info(f"Compiled map written to {compiled_path}")
+        except OSError as e:
+            logging.warning(f"Could not write compiled map {compiled_path}: {e}")
+        return circuit_map
+
+    def compile(self):
+        # calcula todo lo que se guarda en el mapa compilado
+        for name in ("street_coords", "traffic_light_coords", "walkway_coords", "layout"):
+            getattr(self, name)
+
+    def __getstate__(self):
+        # las calles se referencian entre sí y pickle recorrería esas referencias recursivamente, así que se guardan por
+        # columnas con ids; los extremos de calle de elements_at_end se codifican como 2 * id + extremo
+        streets = list(self.streets.values())
+        state = dict(self.__dict__)
+        state["streets"] = {
+            "ids": [street.id for street in streets],
+            "lengths": [street.length for street in streets],
+            "orientations": [_ORIENTATIONS.index(street.orientation) for street in streets],
+            "has_parking": [street.has_parking for street in streets],
+            "parallel_streets": [
+                street.parallel_street.id if street.parallel_street is not None else None
+                for street in streets
+            ],
+            "element_counts": [len(street.elements_at_end) for street in streets],
+            "elements": [
+                2 * element[0].id + element[1].value if type(element) == tuple else element
+                for street in streets
+                for element in street.elements_at_end
+            ]
+        }
+        state["exit_streets"] = [street.id for street in self.exit_streets]
+        return state
+
+    def __setstate__(self, state):
+        columns = state["streets"]
+        streets = {
+            id_: Street(
+                id=id_,
+                length=length,
+                orientation=_ORIENTATIONS[orientation],
+                elements_at_end=[],
+                has_parking=has_parking
+            )
+            for id_, length, orientation, has_parking in zip(
+                columns["ids"], columns["lengths"], columns["orientations"], columns["has_parking"]
+            )
+        }
+        elements = [
+            _extremity(streets[element >> 1], element & 1) if type(element) == int else element
+            for element in columns["elements"]
+        ]
+        start = 0
+        for id_, parallel_street, count in zip(columns["ids"], columns["parallel_streets"], columns["element_counts"]):
+            street = streets[id_]
+            if parallel_street is not None:
+                street.parallel_street = streets[parallel_street]
+            street.elements_at_end = elements[start:start + count]
+            start += count
+        state["streets"] = streets
+        state["exit_streets"] = [streets[id_] for id_ in state["exit_streets"]]
+        self.__dict__.update(state)
+
+    @classmethod
+    def load_json(cls, data):
+        return cls.load_records(data)
+
+    @classmethod
+    def load_records(cls, records):
+        # una sola pasada por las calles, que pueden llegar de un iterador sin tener el mapa entero en memoria: las
+        # referencias a calles ya leídas se resuelven al momento y las demás (parallel_street, @street_start y
+        # @street_end hacia delante) se apuntan y se resuelven al terminar
+        entry_points = set()
+        graphic_hints = {}
+        streets = {}
+        references = set()
+        signals = {}  # (tipo, id) -> SignalRef, para que las calles compartan las mismas referencias
+        pending = []  # (calle, posición en elements_at_end o None para parallel_street, id, extremo)
+
+        for record in records:
+            street = Street(
+                id=record["id"],
+                length=record["length"],
+                orientation=Orientation[record["orientation"]],
+                elements_at_end=[],
+                has_parking=record["has_parking"]
+            )
+            streets[street.id] = street
+            if record.get("is_entry_point", False):
+                entry_points.add(street.id)
+            if street_graphic_hints := record.get("graphic_hint"):
+                graphic_hints[street.id] = street_graphic_hints
+
+            if (parallel_street := record.get("parallel_street")) is not None:
+                pending.append((street, None, parallel_street, None))
+
+            for element in record["elements_at_end"]:
+                references.add(element)
+                kind, _, id_ = element.partition(" ")
+                match kind:
+                    case "@traffic_light" | "@walkway":
+                        key = (kind, int(id_))
+                        if key not in signals:
+                            signals[key] = SignalRef(key[1], walkway=kind == "@walkway")
+                        street.elements_at_end.append(signals[key])
+                    case "@street_start" | "@street_end":
+                        extremity = StreetExtremity.START if kind == "@street_start" else StreetExtremity.END
+                        target = streets.get(int(id_))
+                        if target is None:
+                            pending.append((street, len(street.elements_at_end), int(id_), extremity))
+                        street.elements_at_end.append(None if target is None else _extremity(target, extremity.value))
+                    case "@end":
+                        street.elements_at_end.append(f"@end {int(id_)}")
+
+        logging.info(f"Resolving {len(pending)} forward references...")
+        for street, index, id_, extremity in pending:
+            if index is None:
+                street.parallel_street = streets[id_]
+            else:
+                street.elements_at_end[index] = _extremity(streets[id_], extremity.value)
+
+        # el orden de los semáforos es el de siempre (el del conjunto de referencias), porque de él depende la
+        # secuencia de números aleatorios con la que se crean
+        traffic_light_ids = [int(ref.split(" ")[1]) for ref in references if ref.startswith("@traffic_light")]
+        walkway_ids = [int(ref.split(" ")[1]) for ref in references if ref.startswith("@walkway")]
+
+        logging.info(f"streets loaded: {len(streets)}")
+        logging.info(f"    with graphic hints: {len(graphic_hints)}")
+        logging.info(f"traffic lights: {len(traffic_light_ids)}")
+        logging.info(f"walkways: {len(walkway_ids)}")
+
+        return cls(
+            streets=streets,
+            entry_points=entry_points,
+            traffic_light_ids=traffic_light_ids,
+            walkway_ids=walkway_ids,
+            graphic_hints=graphic_hints
+        )
+
+    @cached_property
+    def street_coords(self):
+        # recorrido en anchura desde la calle 1: cada calle toma las coordenadas de la primera vez que se alcanza, así
+        # que se encola una sola vez y el coste es lineal en el número de calles y referencias
+        logging.info("Computing street coordinates...")
+        start_street = self.streets[1]
+        street_coords = {start_street.id: (0, 0)}  # street.id -> (x, y)
+        queue = deque([start_street])
+        parallel_offsets = self._parallel_offsets()
+
+        def reach(street, coords):
+            if street.id not in street_coords:
+                street_coords[street.id] = coords
+                queue.append(street)
+
+        while queue:
+            current = queue.popleft()
+            x, y = street_coords[current.id]
+            dx, dy = current.orientation.value
+            end_x = x + dx * current.length
+            end_y = y + dy * current.length
+
+            for element in current.elements_at_end:
+                match element:
+                    case (Street, StreetExtremity.START):
+                        reach(element[0], (end_x, end_y))
+                    case (Street, StreetExtremity.END):
+                        dx, dy = element[0].orientation.value
+                        reach(element[0], (end_x - dx * element[0].length, end_y - dy * element[0].length))
+
+            if current.parallel_street is not None and current.id in parallel_offsets:
+                dx, dy = parallel_offsets[current.id].value
+                reach(current.parallel_street, (x + dx * STREET_UNITS_WIDTH, y + dy * STREET_UNITS_WIDTH))
+        return street_coords
+
+    def _parallel_offsets(self):
+        # lado hacia el que se dibuja la paralela de cada calle, sólo cuando el mapa lo indica sin ambigüedad
+        offsets = {}
+        for street_id, hints in self.graphic_hints.items():
+            hints_of_parallel = [hint for hint in hints if hint.startswith("PARALLEL")]
+            if len(hints_of_parallel) == 1:
+                offsets[street_id] = Orientation[hints_of_parallel[0].split(" ")[1]]
+        return offsets
+
+    @cached_property
+    def layout(self):
+        return StreetLayout(self.streets, self.street_coords, self.graphic_hints, STREET_UNITS_WIDTH)
+
+    def _final_element_coords(self, ids, walkway):
+        elements_coords = {}
+        for id_ in ids:
+            street = self.streets[self.signal_streets[SignalRef(id_, walkway)]]
+            start_x, start_y = self.street_coords[street.id]
+            dx, dy = street.orientation.value
+            elements_coords[id_] = (
+                start_x + dx * (street.length - 0.5),  # quitar una unidad para que se quede en la calle
+                start_y + dy * (street.length - 0.5)
+            )
+        return elements_coords
+
+    @cached_property
+    def traffic_light_coords(self):
+        return self._final_element_coords(self.traffic_light_ids, walkway=False)
+
+    @cached_property
+    def walkway_coords(self):
+        return self._final_element_coords(self.walkway_ids, walkway=True)
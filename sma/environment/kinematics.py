@@ -0,0 +1,257 @@
+from bisect import bisect_left
+
+import numpy as np
+
+from sma.environment.car import Car
+from sma.environment.lanes import lane_key, _EPSILON
+from sma.environment.street import Parking
+
+_INITIAL_CAPACITY = 64
+
+
+def _column(array_name, cast):
+    def getter(self):
+        if self._slot is None:
+            return self.__dict__[array_name]
+        return cast(getattr(self._engine, array_name).item(self._slot))
+
+    def setter(self, value):
+        if self._slot is None:
+            self.__dict__[array_name] = value
+        else:
+            getattr(self._engine, array_name)[self._slot] = value
+
+    return property(getter, setter)
+
+
+class CarView(Car):
+    # coche cuyo estado cinemático vive en los arrays de un KinematicsEngine
+
+    def __init__(self, engine, slot, **kwargs):
+        self._engine = engine
+        self._slot = slot
+        super().__init__(**kwargs)
+
+    max_linear_speed = _column("_max_speed", float)
+    length = _column("_length", float)
+    marked_for_deletion = _column("_marked", bool)
+    is_blocked = _column("_blocked", bool)
+    _linear_speed = _column("_speed", float)
+
+    @property
+    def position(self):
+        if self._slot is None:
+            return self.__dict__["position"]
+        engine = self._engine
+        return engine.lanes[engine._lane.item(self._slot)], engine._offset.item(self._slot)
+
+    @position.setter
+    def position(self, position):
+        if self._slot is None:
+            self.__dict__["position"] = position
+            return
+        lane, offset = position
+        self._engine._lane[self._slot] = self._engine.lane_ids[lane_key(lane)]
+        self._engine._offset[self._slot] = offset
+        self._engine._parked[self._slot] = isinstance(lane, Parking)
+        self._engine._dirty.add(self._slot)
+
+    @property
+    def street(self):
+        if self._slot is None:
+            return self.__dict__["position"][0]
+        return self._engine.lanes[self._engine._lane.item(self._slot)]
+
+    def is_parked(self):
+        if self._slot is None:
+            return super().is_parked()
+        return self._engine._parked.item(self._slot)
+
+    def _detach(self):
+        # al borrarse del motor el coche conserva su último estado y deja libre su hueco en los arrays
+        engine, slot = self._engine, self._slot
+        position = self.position
+        self._slot = None
+        self.__dict__.update(
+            position=position,
+            _max_speed=float(engine._max_speed[slot]),
+            _length=float(engine._length[slot]),
+            _marked=bool(engine._marked[slot]),
+            _blocked=bool(engine._blocked[slot]),
+            _speed=float(engine._speed[slot]),
+        )
+
+
+class KinematicsEngine:
+    # estado de la flota en arrays (struct-of-arrays) que se avanza con una operación vectorizada por subpaso
+
+    def __init__(self, streets):
+        self.lanes = []
+        for street in streets.values():
+            self.lanes.append(street)
+            if street.parking is not None:
+                self.lanes.append(street.parking)
+        self.lane_ids = {lane_key(lane): i for i, lane in enumerate(self.lanes)}
+        self._lane_length = np.array([lane.length for lane in self.lanes], dtype=np.float64)
+
+        self._cars = []
+        self._free_slots = []
+        self._size = 0
+        self._max_car_length = 0
+
+        self._lane = np.zeros(_INITIAL_CAPACITY, dtype=np.int32)
+        self._offset = np.zeros(_INITIAL_CAPACITY, dtype=np.float64)
+        self._speed = np.zeros(_INITIAL_CAPACITY, dtype=np.float64)
+        self._max_speed = np.zeros(_INITIAL_CAPACITY, dtype=np.float64)
+        self._length = np.zeros(_INITIAL_CAPACITY, dtype=np.float64)
+        self._blocked = np.zeros(_INITIAL_CAPACITY, dtype=bool)
+        self._parked = np.zeros(_INITIAL_CAPACITY, dtype=bool)
+        self._marked = np.zeros(_INITIAL_CAPACITY, dtype=bool)
+        self._alive = np.zeros(_INITIAL_CAPACITY, dtype=bool)
+        self._moved = np.zeros(_INITIAL_CAPACITY, dtype=bool)  # avanzados desde la última llamada a pop_moved
+
+        # coches vivos ordenados por carril y frontal (slots, carriles, frontales, traseras), calculado como mucho una
+        # vez por subpaso; los coches creados, borrados o que cambian de posición después quedan en _dirty y las
+        # consultas los comprueban aparte
+        self._order = None
+        self._by_lane = None  # lo mismo en listas y carril -> (inicio, fin), para las consultas de coche en coche
+        self._dirty = set()
+
+    def create_car(self, **kwargs):
+        if self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            if self._size == len(self._alive):
+                self._grow()
+            slot = self._size
+            self._size += 1
+            self._cars.append(None)
+
+        self._alive[slot] = True
+        self._dirty.add(slot)
+        car = CarView(self, slot, **kwargs)
+        self._cars[slot] = car
+        self._max_car_length = max(self._max_car_length, car.length)
+        return car
+
+    def remove(self, car):
+        slot = car._slot
+        if slot is None:
+            return
+        car._detach()
+        self._alive[slot] = False
+        self._moved[slot] = False
+        self._cars[slot] = None
+        self._free_slots.append(slot)
+        self._dirty.add(slot)
+
+    def positions(self, cars):
+        # carril, offset y si está aparcado de cada coche, como arrays en el orden recibido
+        slots = np.fromiter((car._slot for car in cars), dtype=np.intp, count=len(cars))
+        return self._lane[slots], self._offset[slots], self._parked[slots]
+
+    def fits_car_at(self, street, point, car_length):
+        lane_id = self.lane_ids.get(lane_key(street))
+        if lane_id is None:
+            return True
+        front = point + car_length / 2
+        rear = point - car_length / 2
+
+        # sólo pueden solaparse los coches del carril con el frontal entre rear y front más la longitud máxima
+        if self._order is None:
+            self._sorted()
+        slots, fronts, rears, bounds = self._by_lane
+        if lane_id in bounds:
+            begin, end = bounds[lane_id]
+            limit = front + self._max_car_length + _EPSILON
+            for i in range(bisect_left(fronts, rear, begin, end), end):
+                if fronts[i] > limit:
+                    break
+                if front >= rears[i] and rear <= fronts[i] and slots[i] not in self._dirty:
+                    return False
+
+        for slot in self._dirty:
+            if self._lane.item(slot) == lane_id and self._alive.item(slot):
+                other_front = self._offset.item(slot) + self._length.item(slot) / 2
+                other_rear = self._offset.item(slot) - self._length.item(slot) / 2
+                if front >= other_rear and rear <= other_front:
+                    return False
+        return True
+
+    def step(self, delta, circuit, safe_distance=0.05):
+        n = self._size
+        moving = self._alive[:n] & ~self._parked[:n] & ~self._marked[:n]
+        speed = self._speed[:n]
+        speed[moving] = self._max_speed[:n][moving]
+
+        ahead = self._cars_ahead(safe_distance) & moving
+        speed[ahead] = 0
+
+        at_end = moving & ~ahead & (self._lane_length[self._lane[:n]] - self._offset[:n] < 0)
+        for slot in np.flatnonzero(at_end):
+            circuit.street_transition(self._cars[slot])
+
+        self._offset[:n][moving] += speed[moving] * delta
+        self._moved[:n] |= moving & (speed != 0)
+        self._order = None
+
+        for slot in np.flatnonzero(moving & (self._lane_length[self._lane[:n]] - self._offset[:n] < 0)):
+            circuit.wake_driver(self._cars[slot])
+
+    def pop_moved(self):
+        slots = np.flatnonzero(self._moved[:self._size])
+        self._moved[:self._size] = False
+        return [self._cars[slot].id for slot in slots]
+
+    def _sorted(self):
+        if self._order is None:
+            slots = np.flatnonzero(self._alive[:self._size])
+            lanes = self._lane[slots]
+            fronts = self._offset[slots] + self._length[slots] / 2
+            rears = self._offset[slots] - self._length[slots] / 2
+            order = np.lexsort((fronts, lanes))
+            slots, lanes, fronts, rears = self._order = (slots[order], lanes[order], fronts[order], rears[order])
+            starts = np.flatnonzero(np.diff(lanes, prepend=-1))
+            ends = np.append(starts[1:], len(lanes))
+            bounds = dict(zip(lanes[starts].tolist(), zip(starts.tolist(), ends.tolist())))
+            self._by_lane = (slots.tolist(), fronts.tolist(), rears.tolist(), bounds)
+            self._dirty.clear()
+        return self._order
+
+    def _cars_ahead(self, safe_distance):
+        # necesita las posiciones actuales de todos los coches en el orden por carril
+        if self._dirty:
+            self._order = None
+        slots, lanes, fronts, rears = self._sorted()
+        ahead = np.zeros(self._size, dtype=bool)
+        if len(slots) == 0:
+            return ahead
+
+        # se comparan sucesivamente los coches siguientes del mismo carril mientras puedan estar a menos de la
+        # distancia de seguridad; con longitudes iguales basta con el inmediatamente siguiente. Los coches con el mismo
+        # frontal (p. ej. una cola en la entrada) no cuentan como delante, así que se empieza por el primero que lo tiene
+        # mayor
+        k = len(slots)
+        limits = fronts + safe_distance + self._max_car_length + _EPSILON
+        found = np.zeros(k, dtype=bool)
+        pending = np.ones(k, dtype=bool)
+        run_starts = np.append(np.flatnonzero((lanes[1:] != lanes[:-1]) | (fronts[1:] != fronts[:-1])) + 1, k)
+        first = run_starts[np.searchsorted(run_starts, np.arange(k), side="right")]
+        for distance in range(k):
+            following = np.minimum(first + distance, k - 1)
+            pending &= (first + distance < k) & (lanes[following] == lanes) & (fronts[following] <= limits) & ~found
+            if not pending.any():
+                break
+            found |= pending & (rears[following] - fronts < safe_distance)
+
+        ahead[slots] = found
+        return ahead
+
+    def _grow(self):
+        capacity = 2 * len(self._alive)
+        for name in ("_lane", "_offset", "_speed", "_max_speed", "_length", "_blocked", "_parked", "_marked",
+                     "_alive", "_moved"):
+            array = getattr(self, name)
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
@@ -0,0 +1,84 @@
+from bisect import bisect_left, bisect_right, insort
+
+from sma.environment.street import Parking
+
+# margen para absorber el redondeo al acotar las búsquedas por la posición del frontal
+_EPSILON = 1e-9
+
+
+def lane_key(lane):
+    if lane is None:
+        return None
+    return isinstance(lane, Parking), lane.id
+
+
+# coches de cada calle (y de cada aparcamiento) ordenados por la posición de su frontal
+class LaneIndex:
+
+    def __init__(self):
+        self._lanes = {}  # lane_key -> [(front, car_id), ...] ordenada
+        self._entries = {}  # car_id -> (lane_key, (front, car_id))
+        self._cars = {}
+        self._max_length = 0
+
+    def update(self, car):
+        key = lane_key(car.street)
+        entry = (car.position[1] + car.length / 2, car.id)
+
+        previous = self._entries.get(car.id)
+        if previous == (key, entry):
+            return
+        if previous is not None:
+            self._discard(*previous)
+
+        insort(self._lanes.setdefault(key, []), entry)
+        self._entries[car.id] = (key, entry)
+        self._cars[car.id] = car
+        self._max_length = max(self._max_length, car.length)
+
+    def remove(self, car):
+        previous = self._entries.pop(car.id, None)
+        if previous is not None:
+            self._discard(*previous)
+            del self._cars[car.id]
+
+    def has_car_ahead(self, car, safe_distance):
+        lane = self._lanes.get(lane_key(car.street), ())
+        front_car = car.position[1] + car.length / 2
+        # un coche con el frontal más allá de este límite tiene la trasera fuera de la distancia de seguridad
+        limit = front_car + safe_distance + self._max_length + _EPSILON
+
+        for i in range(bisect_right(lane, (front_car, float("inf"))), len(lane)):
+            front_other, other_id = lane[i]
+            if front_other > limit:
+                break
+            other = self._cars[other_id]
+            if other is car:
+                continue
+            rear_other = other.position[1] - other.length / 2
+            if front_car < front_other and rear_other - front_car < safe_distance:
+                return True
+        return False
+
+    def fits_car_at(self, street, point, car_length):
+        lane = self._lanes.get(lane_key(street), ())
+        front = point + car_length / 2
+        rear = point - car_length / 2
+        limit = front + self._max_length + _EPSILON
+
+        for i in range(bisect_left(lane, (rear, -1)), len(lane)):
+            other_front, other_id = lane[i]
+            if other_front > limit:
+                break
+            other = self._cars[other_id]
+            other_rear = other.position[1] - other.length / 2
+
+            if front >= other_rear and rear <= other_front:
+                return False
+        return True
+
+    def _discard(self, key, entry):
+        lane = self._lanes[key]
+        del lane[bisect_left(lane, entry)]
+        if not lane:
+            del self._lanes[key]
@@ -0,0 +1,25 @@
+import numpy as np
+
+
+# transformación afín de cada calle en arrays: origen, vector de dirección y desplazamiento de su aparcamiento. Con ella
+# las posiciones (calle, offset) de toda la flota pasan a coordenadas del mundo con una sola operación vectorizada
+class StreetLayout:
+
+    def __init__(self, streets, street_coords, graphic_hints, parking_width):
+        self.rows = {street_id: row for row, street_id in enumerate(streets)}  # street.id -> fila de los arrays
+        self.origin = np.full((len(streets), 2), np.nan)  # las calles sin coordenadas se quedan en NaN
+        self.direction = np.zeros((len(streets), 2))
+        self.parking_offset = np.zeros((len(streets), 2))
+        for row, street in enumerate(streets.values()):
+            dx, dy = street.orientation.value
+            self.direction[row] = (dx, dy)
+            if street.id in street_coords:
+                self.origin[row] = street_coords[street.id]
+            # el aparcamiento va a la derecha de la calle salvo que el mapa indique lo contrario
+            side = -1 if "PARKING LEFT" in graphic_hints.get(street.id, ()) else 1
+            self.parking_offset[row] = (side * dy * parking_width, side * -dx * parking_width)
+
+    def coords(self, rows, offsets, parked):
+        points = self.origin[rows] + self.direction[rows] * offsets[:, None]
+        points[parked] += self.parking_offset[rows[parked]]
+        return points
@@ -0,0 +1,83 @@
+import argparse
+import json
+
+_CHUNK_SIZE = 1 << 16
+_WHITESPACE = " \t\n\r"
+
+
+# lectura incremental de los ficheros de mapa: se devuelve una calle (un dict) cada vez, sin que el módulo json tenga
+# el documento entero en memoria. El mapa puede ser el JSON de siempre (un array de calles) o NDJSON (una calle por línea)
+def read_street_records(path):
+    with open(path) as f:
+        if path.endswith(".ndjson"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from _array_items(f)
+
+
+def _array_items(f):
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    started = False
+    after_item = False
+
+    while True:
+        # se salta el espacio en blanco, leyendo más si hace falta
+        while position < len(buffer) and buffer[position] in _WHITESPACE:
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of map file")
+            buffer, position, eof = _read_more(f, buffer, position)
+            continue
+
+        char = buffer[position]
+        if not started:
+            if char != "[":
+                raise ValueError("A map file must be a JSON array of streets")
+            started = True
+            position += 1
+        elif char == "]":
+            return
+        elif after_item:
+            if char != ",":
+                raise ValueError(f"Expected ',' between streets, found {char!r}")
+            after_item = False
+            position += 1
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # la calle está cortada al final del buffer
+                if eof:
+                    raise
+                buffer, position, eof = _read_more(f, buffer, position)
+                continue
+            yield item
+            position = end
+            after_item = True
+
+
+def _read_more(f, buffer, position):
+    chunk = f.read(max(_CHUNK_SIZE, len(buffer) - position))
+    return buffer[position:] + chunk, 0, not chunk
+
+
+def write_ndjson_map(records, path):
+    with open(path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record, separators=(",", ":")))
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a map file to NDJSON, one street per line")
+    parser.add_argument("source", type=str, help="Map file (.json or .ndjson)")
+    parser.add_argument("target", type=str, help="NDJSON map file")
+    args = parser.parse_args()
+
+    write_ndjson_map(read_street_records(args.source), args.target)
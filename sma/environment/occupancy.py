@@ -0,0 +1,49 @@
+from sma.environment.street import Street
+
+
+# número de coches circulando por cada calle, actualizado al entrar, salir, aparcar o borrarse un coche. Sólo se guardan
+# las calles con algún coche, así que copiarlo cuesta lo que el número de coches y no lo que el mapa
+class StreetOccupancy:
+
+    def __init__(self, streets):
+        self._lengths = {street.id: street.length for street in streets.values()}
+        self._counts = {}
+        self._car_streets = {}  # car_id -> street_id (None si está aparcado)
+
+    def update(self, car):
+        street_id = car.street.id if isinstance(car.street, Street) else None
+        previous = self._car_streets.get(car.id)
+        if car.id in self._car_streets and previous == street_id:
+            return
+
+        if previous is not None:
+            self._leave(previous)
+        if street_id is not None:
+            self._counts[street_id] = self._counts.get(street_id, 0) + 1
+        self._car_streets[car.id] = street_id
+
+    def remove(self, car):
+        previous = self._car_streets.pop(car.id, None)
+        if previous is not None:
+            self._leave(previous)
+
+    def count(self, street_id):
+        return self._counts.get(street_id, 0)
+
+    def density(self, street_id):
+        return self._counts.get(street_id, 0) / self._lengths[street_id]
+
+    def counts(self):
+        # sólo las calles con coches; las demás cuentan 0 (occupancy_from_counts)
+        return dict(self._counts)
+
+    def _leave(self, street_id):
+        count = self._counts[street_id] - 1
+        if count:
+            self._counts[street_id] = count
+        else:
+            del self._counts[street_id]
+
+
+def occupancy_from_counts(counts):
+    return lambda street_id: counts.get(street_id, 0)
@@ -0,0 +1,137 @@
+import math
+from bisect import insort, bisect_left
+
+# holgura para que un hueco propuesto no toque a los coches vecinos (fits_car_at no admite contacto)
+_CLEARANCE = 1e-6
+GRID_CELL_SIZE = 4
+
+
+# tramos ocupados de cada aparcamiento de calle, con búsqueda de huecos libres y del hueco más cercano a un punto
+class ParkingIndex:
+
+    def __init__(self, streets, street_coords):
+        self._streets = {street.id: street for street in streets.values() if street.has_parking}
+        self._occupied = {street_id: [] for street_id in self._streets}  # [(rear, front, car_id), ...] ordenada
+        self._car_spots = {}  # car_id -> (street_id, (rear, front, car_id))
+        self.version = 0
+
+        # rejilla espacial con las calles con aparcamiento según el punto medio de cada una
+        self._origins = {}
+        self._grid = {}
+        self._max_half_length = 0
+        for street_id, street in self._streets.items():
+            if street_id not in street_coords:
+                continue
+            x, y = street_coords[street_id]
+            dx, dy = street.orientation.value
+            self._origins[street_id] = (x, y)
+            cell = self._cell(x + dx * street.length / 2, y + dy * street.length / 2)
+            self._grid.setdefault(cell, []).append(street_id)
+            self._max_half_length = max(self._max_half_length, street.length / 2)
+        self._grid_bounds = (
+            min((cx for cx, _ in self._grid), default=0),
+            min((cy for _, cy in self._grid), default=0),
+            max((cx for cx, _ in self._grid), default=-1),
+            max((cy for _, cy in self._grid), default=-1)
+        )
+
+    def __len__(self):
+        return len(self._car_spots)
+
+    def update(self, car):
+        if car.is_parked() == (car.id in self._car_spots):
+            return
+        if car.is_parked():
+            entry = (car.position[1] - car.length / 2, car.position[1] + car.length / 2, car.id)
+            insort(self._occupied[car.street.id], entry)
+            self._car_spots[car.id] = (car.street.id, entry)
+            self.version += 1
+        else:
+            self.remove(car)
+
+    def remove(self, car):
+        spot = self._car_spots.pop(car.id, None)
+        if spot is not None:
+            street_id, entry = spot
+            occupied = self._occupied[street_id]
+            del occupied[bisect_left(occupied, entry)]
+            self.version += 1
+
+    def occupied(self, street_id):
+        return [(rear, front) for rear, front, _ in self._occupied.get(street_id, ())]
+
+    def free_gaps(self, street_id, min_length=0, reserved=()):
+        # tramos libres (inicio, fin) del aparcamiento, considerando también ocupados los tramos reservados
+        street = self._streets.get(street_id)
+        if street is None:
+            return []
+        occupied = self.occupied(street_id)
+        if reserved:
+            occupied = sorted(occupied + list(reserved))
+
+        gaps = []
+        start = 0
+        for rear, front in occupied:
+            if rear - start > min_length:
+                gaps.append((start, rear))
+            start = max(start, front)
+        if street.length - start > min_length:
+            gaps.append((start, street.length))
+        return gaps
+
+    def spot_in_gap(self, gap, position, length):
+        # posición del centro del coche dentro del hueco lo más cerca posible de position
+        start, end = gap
+        return min(max(position, start + length / 2 + _CLEARANCE), end - length / 2 - _CLEARANCE)
+
+    def nearest_free_spot(self, x, y, length, reserved=None) -> tuple[int, float] | None:
+        # (street_id, posición) del hueco libre más cercano al punto; se recorre la rejilla por anillos crecientes
+        reserved = reserved or {}
+        best = None
+        best_distance = math.inf
+        center_x, center_y = self._cell(x, y)
+        min_x, min_y, max_x, max_y = self._grid_bounds
+        max_ring = -1 if not self._grid else max(
+            abs(min_x - center_x), abs(max_x - center_x), abs(min_y - center_y), abs(max_y - center_y)
+        )
+
+        for ring in range(max_ring + 1):
+            # una calle de este anillo no puede estar más cerca que el borde interior del anillo menos media calle
+            if (ring - 1) * GRID_CELL_SIZE - self._max_half_length > best_distance:
+                break
+            for street_id in self._ring(center_x, center_y, ring):
+                street = self._streets[street_id]
+                origin_x, origin_y = self._origins[street_id]
+                dx, dy = street.orientation.value
+                projection = (x - origin_x) * dx + (y - origin_y) * dy
+
+                for gap in self.free_gaps(street_id, length + 2 * _CLEARANCE, reserved.get(street_id, ())):
+                    position = self.spot_in_gap(gap, projection, length)
+                    distance = math.hypot(origin_x + dx * position - x, origin_y + dy * position - y)
+                    if distance < best_distance:
+                        best = (street_id, position)
+                        best_distance = distance
+        return best
+
+    def position_coords(self, street_id, position):
+        street = self._streets.get(street_id)
+        if street is None or street_id not in self._origins:
+            return None
+        origin_x, origin_y = self._origins[street_id]
+        dx, dy = street.orientation.value
+        return origin_x + dx * position, origin_y + dy * position
+
+    def _ring(self, center_x, center_y, ring):
+        if ring == 0:
+            yield from self._grid.get((center_x, center_y), ())
+            return
+        for offset in range(-ring, ring + 1):
+            yield from self._grid.get((center_x + offset, center_y - ring), ())
+            yield from self._grid.get((center_x + offset, center_y + ring), ())
+        for offset in range(-ring + 1, ring):
+            yield from self._grid.get((center_x - ring, center_y + offset), ())
+            yield from self._grid.get((center_x + ring, center_y + offset), ())
+
+    @staticmethod
+    def _cell(x, y):
+        return int(math.floor(x / GRID_CELL_SIZE)), int(math.floor(y / GRID_CELL_SIZE))
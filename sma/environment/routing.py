@@ -0,0 +1,290 @@
+import heapq
+import logging
+import math
+from array import array
+from collections import OrderedDict
+from operator import sub
+
+from sma.environment.occupancy import occupancy_from_counts
+
+
+def turn_cost(street, target_street):
+    return 0 if target_street.orientation == street.orientation else 1
+
+
+class StreetGraph:
+    # grafo de calles precompilado: sucesores con su coste estático (longitud de la calle destino más el giro) y
+    # distancias a unos pocos landmarks (ALT) que dan una heurística admisible para el A* del planificador
+
+    def __init__(self, streets, landmarks=0):
+        self.successors = {street.id: [] for street in streets.values()}
+        self.predecessors = {street.id: [] for street in streets.values()}
+        for street in streets.values():
+            for neighbor in street.available_target_streets():
+                cost = neighbor.length + turn_cost(street, neighbor)
+                self.successors[street.id].append((neighbor.id, cost))
+                self.predecessors[neighbor.id].append((street.id, cost))
+
+        self.landmarks = []
+        self._landmark_distances = {}  # street_id -> (distancias desde cada landmark, distancias hasta cada landmark)
+        if landmarks > 0:
+            self._select_landmarks(landmarks)
+            logging.info(f"Routing landmarks: {self.landmarks}")
+
+    def __len__(self):
+        return len(self.successors)
+
+    def __getstate__(self):
+        # listas planas en lugar de un diccionario por calle, que pickle guarda y recupera mucho más deprisa (el grafo
+        # va en el mapa compilado y se envía a los procesos de planificación)
+        street_ids = list(self.successors)
+        return {
+            "street_ids": array("q", street_ids),
+            "successors": _flatten_edges(self.successors, street_ids),
+            "predecessors": _flatten_edges(self.predecessors, street_ids),
+            "landmarks": self.landmarks,
+            "landmark_distances": array("d", (
+                distance
+                for street_id in street_ids if self._landmark_distances
+                for distances in self._landmark_distances[street_id]
+                for distance in distances
+            ))
+        }
+
+    def __setstate__(self, state):
+        street_ids = state["street_ids"].tolist()
+        self.successors = _unflatten_edges(street_ids, *state["successors"])
+        self.predecessors = _unflatten_edges(street_ids, *state["predecessors"])
+        self.landmarks = state["landmarks"]
+        count = len(self.landmarks)
+        distances = iter(state["landmark_distances"].tolist())
+        per_landmark = list(zip(*[distances] * count)) if count else []
+        self._landmark_distances = dict(zip(street_ids, zip(per_landmark[0::2], per_landmark[1::2])))
+
+    def heuristic_to(self, goal_id):
+        if not self.landmarks:
+            return lambda street_id: 0
+        goal_from, goal_to = self._landmark_distances[goal_id]
+        cache = {}
+
+        def heuristic(street_id):
+            # desigualdad triangular: d(v, goal) >= d(L, goal) - d(L, v) y d(v, goal) >= d(v, L) - d(goal, L);
+            # con distancias infinitas sale inf (inalcanzable) o nan/-inf, que nunca superan al 0 inicial
+            bound = cache.get(street_id)
+            if bound is None:
+                street_from, street_to = self._landmark_distances[street_id]
+                bound = max(0, *map(sub, goal_from, street_from), *map(sub, street_to, goal_to))
+                cache[street_id] = bound
+            return bound
+
+        return heuristic
+
+    def distances(self, source_id, reverse=False):
+        edges = self.predecessors if reverse else self.successors
+        distances = dict.fromkeys(edges, math.inf)
+        distances[source_id] = 0
+        queue = [(0, source_id)]
+        while queue:
+            distance, current = heapq.heappop(queue)
+            if distance > distances[current]:
+                continue
+            for neighbor, cost in edges[current]:
+                if distance + cost < distances[neighbor]:
+                    distances[neighbor] = distance + cost
+                    heapq.heappush(queue, (distance + cost, neighbor))
+        return distances
+
+    def _select_landmarks(self, count):
+        # selección por el más lejano: cada landmark nuevo es la calle más alejada de los ya elegidos
+        street_ids = sorted(self.successors)
+        candidate = street_ids[0]
+        closest = dict.fromkeys(street_ids, math.inf)
+        from_landmarks = []
+        to_landmarks = []
+
+        while len(self.landmarks) < min(count, len(street_ids)):
+            self.landmarks.append(candidate)
+            from_landmarks.append(self.distances(candidate))
+            to_landmarks.append(self.distances(candidate, reverse=True))
+
+            for street_id in street_ids:
+                distance = min(from_landmarks[-1][street_id], to_landmarks[-1][street_id])
+                closest[street_id] = min(closest[street_id], distance)
+
+            remaining = [street_id for street_id in street_ids if street_id not in self.landmarks]
+            if not remaining:
+                break
+            reachable = [street_id for street_id in remaining if closest[street_id] < math.inf]
+            candidate = max(reachable or remaining, key=lambda street_id: (closest[street_id], -street_id))
+
+        self._landmark_distances = {
+            street_id: (
+                tuple(distances[street_id] for distances in from_landmarks),
+                tuple(distances[street_id] for distances in to_landmarks)
+            )
+            for street_id in street_ids
+        }
+
+
+def _flatten_edges(edges, street_ids):
+    return (
+        array("q", (len(edges[street_id]) for street_id in street_ids)),
+        array("q", (neighbor for street_id in street_ids for neighbor, _ in edges[street_id])),
+        array("d", (cost for street_id in street_ids for _, cost in edges[street_id]))
+    )
+
+
+def _unflatten_edges(street_ids, counts, neighbors, costs):
+    pairs = list(zip(neighbors.tolist(), costs.tolist()))
+    edges = {}
+    start = 0
+    for street_id, count in zip(street_ids, counts.tolist()):
+        edges[street_id] = pairs[start:start + count]
+        start += count
+    return edges
+
+
+def shortest_path(graph, start_id, goal_id, occupancy) -> list[int] | None:
+    # A* con el coste del planificador: longitud de la calle destino, coches que hay en ella y giro
+    heuristic = graph.heuristic_to(goal_id)
+    open_set = [(heuristic(start_id), start_id)]
+    came_from = {}
+    estimated_costs = {start_id: 0}
+    closed = set()
+
+    while open_set:
+        _, current = heapq.heappop(open_set)
+        if current in closed:
+            continue
+        closed.add(current)
+
+        if current == goal_id:
+            path = [current]
+            while current in came_from:
+                current = came_from[current]
+                path.append(current)
+
+            return list(reversed(path[:-1]))
+
+        for neighbor, static_cost in graph.successors[current]:
+            estimated_cost = estimated_costs[current] + static_cost + occupancy(neighbor)
+            if estimated_cost < estimated_costs.get(neighbor, math.inf):
+                came_from[neighbor] = current
+                estimated_costs[neighbor] = estimated_cost
+                remaining_cost = heuristic(neighbor)
+                if remaining_cost < math.inf:
+                    heapq.heappush(open_set, (estimated_cost + remaining_cost, neighbor))
+    return None
+
+
+def shortest_paths_to(graph, goal_id, start_ids, occupancy) -> dict[int, list[int] | None]:
+    # árbol de caminos mínimos inverso desde el destino: resuelve a la vez todas las peticiones con el mismo destino
+    pending = set(start_ids)
+    costs_to_goal = {goal_id: 0}
+    next_hop = {}
+    queue = [(0, goal_id)]
+    closed = set()
+
+    while queue and pending:
+        cost, current = heapq.heappop(queue)
+        if current in closed:
+            continue
+        closed.add(current)
+        pending.discard(current)
+
+        # el coste de llegar a una calle incluye su longitud, sus coches y el giro desde la calle anterior
+        entering_cost = cost + occupancy(current)
+        for previous, static_cost in graph.predecessors[current]:
+            estimated_cost = entering_cost + static_cost
+            if estimated_cost < costs_to_goal.get(previous, math.inf):
+                costs_to_goal[previous] = estimated_cost
+                next_hop[previous] = current
+                heapq.heappush(queue, (estimated_cost, previous))
+
+    paths = {}
+    for start_id in start_ids:
+        if start_id not in closed:
+            paths[start_id] = None
+            continue
+        path = []
+        current = start_id
+        while current != goal_id:
+            current = next_hop[current]
+            path.append(current)
+        paths[start_id] = path
+    return paths
+
+
+def plan_batch(graph, goal_id, start_ids, occupancy) -> dict[int, list[int] | None]:
+    if len(start_ids) == 1:
+        return {start_ids[0]: shortest_path(graph, start_ids[0], goal_id, occupancy)}
+    return shortest_paths_to(graph, goal_id, start_ids, occupancy)
+
+
+# copia de solo lectura del grafo en cada proceso del pool de planificación
+_worker_graph = None
+
+
+def init_planning_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def plan_batches_in_worker(batches, occupancy_counts) -> list[dict[int, list[int] | None]]:
+    # varios destinos (goal_id, start_ids) por tarea, para que la ocupación se envíe una vez por proceso y no por destino
+    occupancy = occupancy_from_counts(occupancy_counts)
+    return [plan_batch(_worker_graph, goal_id, start_ids, occupancy) for goal_id, start_ids in batches]
+
+
+class RouteCache:
+    # caché LRU de rutas por (calle origen, calle destino); una entrada caduca al cambiar de época de congestión o
+    # cuando la ocupación de las calles de la ruta se aleja de la que había al calcularla más que el umbral
+
+    def __init__(self, capacity, occupancy_threshold):
+        self.capacity = capacity
+        self.occupancy_threshold = occupancy_threshold
+        self._entries = OrderedDict()  # (start_id, goal_id) -> (path, ocupación de cada calle, época)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, start_id, goal_id, occupancy, epoch) -> list[int] | None:
+        key = (start_id, goal_id)
+        entry = self._entries.get(key)
+        if entry is not None:
+            path, path_occupancy, entry_epoch = entry
+            drift = sum(abs(occupancy(street_id) - count) for street_id, count in zip(path, path_occupancy))
+            if entry_epoch == epoch and drift <= self.occupancy_threshold:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(path)
+
+            del self._entries[key]
+            self.invalidations += 1
+        self.misses += 1
+        return None
+
+    def put(self, start_id, goal_id, path, occupancy, epoch):
+        if self.capacity <= 0 or path is None:
+            return
+        key = (start_id, goal_id)
+        self._entries[key] = (tuple(path), tuple(occupancy(street_id) for street_id in path), epoch)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "size": len(self._entries)
+        }
@@ -0,0 +1,71 @@
+import cProfile
+import logging
+from collections import defaultdict
+from time import perf_counter
+
+
+# tiempo de pared y número de llamadas de cada fase de Circuit.step. El circuito sólo tiene uno cuando se activa, así
+# que sin él cada fase cuesta una comprobación. Opcionalmente guarda un perfil de cProfile de una ventana de pasos
+class PhaseTimer:
+
+    def __init__(self, profile_steps=None, profile_output=None):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.steps = 0
+        self.profile_steps = profile_steps  # (primer paso, paso siguiente al último), contando los de pre-simulación
+        self.profile_output = profile_output
+        self._profiler = None
+
+    def lap(self, phase, start):
+        now = perf_counter()
+        self.seconds[phase] += now - start
+        self.calls[phase] += 1
+        return now
+
+    def timed(self, phase, function):
+        def timed_function(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.lap(phase, start)
+
+        return timed_function
+
+    def begin_step(self):
+        if self.profile_steps is not None and self.steps == self.profile_steps[0]:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def end_step(self):
+        self.steps += 1
+        if self._profiler is not None and self.steps >= self.profile_steps[1]:
+            self._dump_profile()
+
+    def _dump_profile(self):
+        self._profiler.disable()
+        self._profiler.dump_stats(self.profile_output)
+        logging.info(f"Profile of steps {self.profile_steps[0]}-{self.steps} written to {self.profile_output}")
+        self._profiler = None
+        self.profile_steps = None
+
+    async def on_tick(self):
+        pass
+
+    def stats(self):
+        return {
+            "steps": self.steps,
+            **{
+                phase: {
+                    "calls": self.calls[phase],
+                    "seconds": seconds,
+                    "average_us": seconds / self.calls[phase] * 1e6
+                }
+                for phase, seconds in sorted(self.seconds.items())
+            }
+        }
+
+    def close(self):
+        # la ventana no llegó a terminar: se guarda lo perfilado hasta ahora
+        if self._profiler is not None:
+            self._dump_profile()
@@ -1,7 +1,16 @@
+import heapq
+import itertools
 import random
+from bisect import bisect_right
 from dataclasses import dataclass
 from enum import Enum
 
+import numpy as np
+
+_INITIAL_DELTAS_CAPACITY = 4096
+# los semáforos se sacan de la cola un poco antes del cambio previsto para absorber el redondeo del reloj
+_SWITCH_MARGIN = 1e-6
+
 
 class TrafficColor(int, Enum):
     RED = 0
@@ -17,13 +26,13 @@ class TrafficLight:
     _counter: int = 0
 
     @classmethod
-    def random(cls, id_):
+    def random(cls, id_, rng=random):
         return cls(
             id=id_,
-            color=random.choice(list(TrafficColor)),
+            color=rng.choice(list(TrafficColor)),
             color_durations={
-                TrafficColor.RED: random.randint(1, 8),
-                TrafficColor.GREEN: random.randint(6, 15)
+                TrafficColor.RED: rng.randint(1, 8),
+                TrafficColor.GREEN: rng.randint(6, 15)
             }
         )
 
@@ -38,3 +47,136 @@ class TrafficLight:
 
     def _change_color(self):
         self.color = TrafficColor((self.color.value + 1) % len(TrafficColor))
+
+
+# semáforo o paso de peatones al final de una calle del mapa compartido; el color lo tiene cada circuito
+@dataclass(frozen=True)
+class SignalRef:
+    id: int
+    walkway: bool
+
+
+class TrafficLightScheduler:
+    # cola de prioridad con el próximo instante de cambio de cada semáforo; sólo se tocan los que están a punto de
+    # cambiar. Para que cambien en el mismo subpaso que con TrafficLight.step, su contador se rehace al sacarlo de la
+    # cola sumando en orden los deltas desde la última vez que se actualizó, con el mismo redondeo que el del semáforo
+
+    def __init__(self, traffic_lights):
+        self.time = 0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._deltas = np.zeros(_INITIAL_DELTAS_CAPACITY)  # deltas de los subpasos a partir del número _first
+        self._first = 0
+        self._substeps = 0
+        for traffic_light in traffic_lights:
+            self._schedule(traffic_light, traffic_light._counter)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def advance(self, delta):
+        if self._substeps - self._first == len(self._deltas):
+            self._compact()
+        self._deltas[self._substeps - self._first] = delta
+        self._substeps += 1
+        self.time += delta
+
+        switched = []
+        waiting = []
+        while self._queue and self._queue[0][0] <= self.time:
+            _, _, traffic_light, counter, substep = heapq.heappop(self._queue)
+            counter = self._replay(counter, substep)
+            current_color_duration = traffic_light.color_durations[traffic_light.color]
+            if counter >= current_color_duration:
+                counter -= current_color_duration
+                traffic_light._change_color()
+                switched.append(traffic_light)
+            traffic_light._counter = counter
+            waiting.append(traffic_light)
+
+        # se vuelven a encolar al final: los que aún no han cambiado se miran otra vez en el siguiente subpaso
+        for traffic_light in waiting:
+            self._schedule(traffic_light, traffic_light._counter)
+        return switched
+
+    def _replay(self, counter, substep):
+        deltas = self._deltas[substep - self._first:self._substeps - self._first]
+        if len(deltas) == 0:
+            return counter
+        # accumulate suma de izquierda a derecha, como el contador del semáforo (sum lo haría por parejas)
+        return float(np.add.accumulate(np.concatenate(([counter], deltas)))[-1])
+
+    def _schedule(self, traffic_light, counter):
+        # el contador está al día hasta el subpaso actual
+        switch_time = self.time + traffic_light.color_durations[traffic_light.color] - counter - _SWITCH_MARGIN
+        heapq.heappush(self._queue, (switch_time, next(self._sequence), traffic_light, counter, self._substeps))
+
+    def _compact(self):
+        # se descartan los deltas que ya no necesita ningún semáforo; si aun así no hay sitio se duplica el array
+        first = min((entry[4] for entry in self._queue), default=self._substeps)
+        kept = self._deltas[first - self._first:self._substeps - self._first]
+        deltas = self._deltas if 2 * len(kept) <= len(self._deltas) else np.zeros(2 * len(self._deltas))
+        deltas[:len(kept)] = kept
+        self._deltas = deltas
+        self._first = first
+
+
+class SignalTrack:
+    # color de un semáforo a lo largo de un histórico: color inicial y frames a partir de los que cambia
+
+    def __init__(self, color=None):
+        self.initial = color
+        self.frames = []
+        self.colors = []
+
+    def record(self, frame, color):
+        if self.frames and self.frames[-1] == frame:
+            self.colors[-1] = color
+        else:
+            self.frames.append(frame)
+            self.colors.append(color)
+
+    def color_at(self, frame):
+        switches = bisect_right(self.frames, frame)
+        return self.colors[switches - 1] if switches else self.initial
+
+
+@dataclass
+class SignalTracks:
+    traffic_lights: dict[int, SignalTrack]
+    walkways: dict[int, SignalTrack]
+
+    @classmethod
+    def starting_from(cls, traffic_lights, walkways):
+        return cls(
+            traffic_lights={id_: SignalTrack(light.color) for id_, light in traffic_lights.items()},
+            walkways={id_: SignalTrack(walkway.color) for id_, walkway in walkways.items()}
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        tracks = cls(traffic_lights={}, walkways={})
+        for name in ("traffic_lights", "walkways"):
+            for id_, initial, frames, colors in data[name]:
+                track = SignalTrack(initial)
+                track.frames = list(frames)
+                track.colors = list(colors)
+                getattr(tracks, name)[id_] = track
+        return tracks
+
+    def to_dict(self):
+        return {
+            name: [[id_, track.initial, track.frames, track.colors] for id_, track in getattr(self, name).items()]
+            for name in ("traffic_lights", "walkways")
+        }
+
+    def record(self, frame, traffic_lights, walkways):
+        for tracks, switched in ((self.traffic_lights, traffic_lights), (self.walkways, walkways)):
+            for id_, color in switched.items():
+                tracks.setdefault(int(id_), SignalTrack()).record(frame, color)
+
+    def colors_at(self, frame):
+        return (
+            {id_: track.color_at(frame) for id_, track in self.traffic_lights.items()},
+            {id_: track.color_at(frame) for id_, track in self.walkways.items()}
+        )
@@ -0,0 +1,78 @@
+import argparse
+import logging
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sma.config import PIXELS_PER_UNIT
+from sma.environment.circuitmap import CircuitMap
+from sma.history.formats import load_history
+from sma.rendering import StaticLayer, FrameRenderer
+
+FRAME_NAME = "frame_{:06d}.png"
+_CHUNKS_PER_WORKER = 4  # rangos de frames por proceso, para repartir la carga sin perder la lectura en orden
+
+# histórico y renderer de cada proceso del pool de exportación; el histórico se abre en cada proceso y la geometría de
+# las calles llega ya calculada desde el proceso principal
+_worker_renderer = None
+_worker_history = None
+
+
+def init_export_worker(history_path, static_layer, scale):
+    global _worker_renderer, _worker_history
+    _worker_history = load_history(history_path)
+    _worker_renderer = FrameRenderer(_worker_history, static_layer, scale)
+
+
+def export_frames_in_worker(start, stop, directory):
+    export_frames(_worker_history, _worker_renderer, start, stop, directory)
+    return stop - start
+
+
+def export_frames(history, renderer, start, stop, directory):
+    # los frames se piden en orden para que los históricos con diferencias apliquen una sola por frame
+    for index in range(start, stop):
+        renderer.render(history.history[index]).save(os.path.join(directory, FRAME_NAME.format(index)))
+
+
+def export_history(map_path, history_path, directory, start=0, stop=None, workers=None, scale=PIXELS_PER_UNIT):
+    history = load_history(history_path)
+    history.streets = CircuitMap.load(map_path).streets
+    static_layer = StaticLayer(history)
+    stop = len(history.history) if stop is None else min(stop, len(history.history))
+    workers = os.cpu_count() if workers is None else workers
+    os.makedirs(directory, exist_ok=True)
+
+    start_time = time.perf_counter()
+    if workers <= 1:
+        export_frames(history, FrameRenderer(history, static_layer, scale), start, stop, directory)
+    else:
+        chunk = max(1, math.ceil((stop - start) / (workers * _CHUNKS_PER_WORKER)))
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=init_export_worker,
+                initargs=(history_path, static_layer, scale)
+        ) as executor:
+            futures = [
+                executor.submit(export_frames_in_worker, chunk_start, min(chunk_start + chunk, stop), directory)
+                for chunk_start in range(start, stop, chunk)
+            ]
+            for future in futures:
+                future.result()
+    logging.info(f"Exported {max(0, stop - start)} frames to {directory} in {time.perf_counter() - start_time:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a simulation history to PNG frames without a display")
+    parser.add_argument("map", type=str, help="Map file")
+    parser.add_argument("history", type=str, help="History file (.json, .ndjson or .hist)")
+    parser.add_argument("directory", type=str, help="Output directory for the frames")
+    parser.add_argument("--start", type=int, default=0, help="First frame to export")
+    parser.add_argument("--stop", type=int, help="Frame after the last one to export")
+    parser.add_argument("--workers", type=int, help="Processes used to render, 1 to render in this process")
+    parser.add_argument("--scale", type=float, default=PIXELS_PER_UNIT, help="Pixels per street length unit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    export_history(args.map, args.history, args.directory, args.start, args.stop, args.workers, args.scale)
@@ -1,13 +1,26 @@
+import logging
+import math
+import time
 import tkinter as tk
+from collections import OrderedDict
 
-from sma.agent.driver import State
-from sma.config import PERIOD, PIXELS_PER_UNIT, MARGIN
-from sma.environment.circuit import STREET_UNITS_WIDTH, SimulationHistory
-from sma.environment.street import Orientation
-from sma.environment.trafficlight import TrafficColor
+from PIL import ImageTk
 
+from sma.config import PERIOD, PIXELS_PER_UNIT, MARGIN, ZOOM_LEVELS, TILE_SIZE, TILE_CACHE_SIZE
+from sma.environment.circuit import SimulationHistory
+from sma.environment.circuitmap import STREET_UNITS_WIDTH
+from sma.rendering import StaticLayer, CAR_COLORS, TRAFFIC_LIGHT_COLORS, WALKWAY_COLORS
 
-# Asumimos que Orientation, StreetExtremity, Street, Circuit ya están definidos en tu entorno
+_BUCKET_SIZE = 8  # unidades de calle por celda de la rejilla con la que se descartan coches y semáforos no visibles
+
+
+def _cell(x, y):
+    return math.floor(x / _BUCKET_SIZE), math.floor(y / _BUCKET_SIZE)
+
+
+def _tile_range(offset, size):
+    # teselas que cubren los píxeles [0, size) de la ventana, con el mapa desplazado offset píxeles
+    return range(math.floor(-offset / TILE_SIZE), math.floor((size - offset) / TILE_SIZE) + 1)
 
 
 class Graphics:
@@ -15,30 +28,82 @@ class Graphics:
         self.simulation_history = simulation_history
         self.tk = tk.Tk()
         self.tk.title("Simulador de Tráfico")
-        self.canvas = tk.Canvas(self.tk, width=1000, height=800, bg="white")
+        self.width = 1000
+        self.height = 800
+        self.canvas = tk.Canvas(self.tk, width=self.width, height=self.height, bg="white")
         self.offset_x = 0
         self.offset_y = 0
+        self.zoom_level = ZOOM_LEVELS.index(1)
 
         self._simulation_step = 0
+        self._snapshot = None
+        self._snapshot_step = None
+        self._start_time = None
+        self._skipped_frames = 0
+        self._drag = None
+
+        # el mapa se dibuja una vez por tesela y nivel de zoom; sólo las teselas visibles tienen imagen en el canvas
+        self.static_layer = StaticLayer(simulation_history)
+        self._tiles = OrderedDict()  # (zoom_level, tx, ty) -> PhotoImage, o None si la tesela está vacía
+        self._tile_items = {}  # (zoom_level, tx, ty) -> (item, PhotoImage)
+
+        # coches y semáforos por celdas del mapa; sólo los de las celdas visibles tienen elemento en el canvas
+        self._visible_cells = set()
+        self._buckets = {}  # celda -> car_ids
+        self._car_cells = {}  # car_id -> celda
+        self._car_positions = {}  # car_id -> (x, y)
+        self._traffic_light_cells = {
+            tid: _cell(x - 0.5, y) for tid, (x, y) in simulation_history.traffic_lights_coords.items()
+        }
+        self._walkway_cells = {wid: _cell(x, y) for wid, (x, y) in simulation_history.walkways_coords.items()}
+
+        # un elemento del canvas por coche y por semáforo visible, con lo último que se dibujó en él
+        self._car_items = {}  # car_id -> (item, (x, y), color)
+        self._traffic_light_items = {}  # id -> (item, color)
+        self._walkway_items = {}  # id -> (item, color)
+
+    @property
+    def scale(self):
+        return PIXELS_PER_UNIT * ZOOM_LEVELS[self.zoom_level]
 
     @property
     def snapshot(self):
-        return self.simulation_history.history[self._simulation_step]
+        # los históricos con diferencias reconstruyen el frame en cada acceso, así que se guarda el del paso actual
+        if self._snapshot_step != self._simulation_step:
+            self._snapshot = self.simulation_history.history[self._simulation_step]
+            self._snapshot_step = self._simulation_step
+        return self._snapshot
 
     def run(self):
-        self.canvas.pack()
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+        self.canvas.bind("<Configure>", self._on_resize)
+        self.canvas.bind("<ButtonPress-1>", self._on_drag_start)
+        self.canvas.bind("<B1-Motion>", self._on_drag)
+        self.canvas.bind("<MouseWheel>", lambda event: self._zoom(event.x, event.y, 1 if event.delta > 0 else -1))
+        self.canvas.bind("<Button-4>", lambda event: self._zoom(event.x, event.y, 1))
+        self.canvas.bind("<Button-5>", lambda event: self._zoom(event.x, event.y, -1))
         self._render_circuit()
+        self._start_time = time.perf_counter()
         self.refresh()
         self.tk.mainloop()
 
     def refresh(self):
+        # se dibuja el frame que corresponde al tiempo transcurrido; los que no dio tiempo a dibujar se saltan
+        due_step = int((time.perf_counter() - self._start_time) / PERIOD)
+        if due_step > self._simulation_step:
+            self._skipped_frames += due_step - self._simulation_step
+            self._simulation_step = due_step
+
         if self._simulation_step < len(self.simulation_history.history):
-            self.canvas.after(int(PERIOD * 1000), self.refresh)
+            self._track_cars()
             self._render_traffic_lights()
             self._render_walkways()
             self._render_cars()
             self._simulation_step += 1
+            next_frame_time = self._start_time + self._simulation_step * PERIOD
+            self.canvas.after(max(1, int((next_frame_time - time.perf_counter()) * 1000)), self.refresh)
         else:
+            logging.info(f"Playback finished, {self._skipped_frames} frames skipped")
             self.tk.destroy()
 
     def _render_circuit(self):
@@ -52,124 +117,208 @@ class Graphics:
 
         self.offset_x = (-min_x if min_x < 0 else 0) + MARGIN
         self.offset_y = (-min_y if min_y < 0 else 0) + MARGIN
+        self._update_viewport()
 
-        for sid, (x, y) in street_coords.items():
-            street = self.simulation_history.streets[int(sid)]
-            screen_x = x * PIXELS_PER_UNIT + self.offset_x
-            screen_y = y * PIXELS_PER_UNIT + self.offset_y
-            dx, dy = street.orientation.value
+    def _update_viewport(self):
+        scale = self.scale
+        min_x = -self.offset_x / scale - STREET_UNITS_WIDTH
+        min_y = -self.offset_y / scale - STREET_UNITS_WIDTH
+        max_x = (self.width - self.offset_x) / scale + STREET_UNITS_WIDTH
+        max_y = (self.height - self.offset_y) / scale + STREET_UNITS_WIDTH
+        (min_cell_x, min_cell_y), (max_cell_x, max_cell_y) = _cell(min_x, min_y), _cell(max_x, max_y)
+        self._visible_cells = {
+            (cell_x, cell_y)
+            for cell_x in range(min_cell_x, max_cell_x + 1)
+            for cell_y in range(min_cell_y, max_cell_y + 1)
+        }
+        self._render_tiles()
+        if self._snapshot is not None:
+            self._render_traffic_lights()
+            self._render_walkways()
+            self._render_cars()
+
+    def _render_tiles(self):
+        visible = {
+            (self.zoom_level, tx, ty)
+            for tx in _tile_range(self.offset_x, self.width)
+            for ty in _tile_range(self.offset_y, self.height)
+        }
+        for key in [key for key in self._tile_items if key not in visible]:
+            self.canvas.delete(self._tile_items.pop(key)[0])
+
+        for key in visible - self._tile_items.keys():
+            image = self._tile(key)
+            if image is None:
+                continue
+            _, tx, ty = key
+            item = self.canvas.create_image(
+                tx * TILE_SIZE + self.offset_x,
+                ty * TILE_SIZE + self.offset_y,
+                image=image,
+                anchor=tk.NW,
+                tags="tile"
+            )
+            self.canvas.tag_lower(item)
+            self._tile_items[key] = (item, image)
 
-            if street.has_parking:
-                perp_x, perp_y = dy, -dx
-                if "PARKING LEFT" in self.simulation_history.graphic_hints.get(sid, {}):
-                    perp_x *= -1
-                    perp_y *= -1
-                parking_screen_x = screen_x + perp_x * PIXELS_PER_UNIT * STREET_UNITS_WIDTH
-                parking_screen_y = screen_y + perp_y * PIXELS_PER_UNIT * STREET_UNITS_WIDTH
-                self._draw_street(parking_screen_x, parking_screen_y, dx, dy, street.length * PIXELS_PER_UNIT, "blue",
-                                  False)
+    def _tile(self, key):
+        if key in self._tiles:
+            self._tiles.move_to_end(key)
+            return self._tiles[key]
 
-            self._draw_street(screen_x, screen_y, dx, dy, street.length * PIXELS_PER_UNIT, "gray", True)
+        _, tx, ty = key
+        left, top = tx * TILE_SIZE, ty * TILE_SIZE
+        scale = self.scale
+        bounds = (left / scale, top / scale, (left + TILE_SIZE) / scale, (top + TILE_SIZE) / scale)
+        image = None
+        if self.static_layer.shapes_in(*bounds):
+            image = ImageTk.PhotoImage(self.static_layer.render(scale, left, top, TILE_SIZE, TILE_SIZE))
+        self._tiles[key] = image
+        if len(self._tiles) > TILE_CACHE_SIZE:
+            self._tiles.popitem(last=False)
+        return image
+
+    def _on_resize(self, event):
+        self.width, self.height = event.width, event.height
+        self._update_viewport()
+
+    def _on_drag_start(self, event):
+        self._drag = (event.x, event.y)
+
+    def _on_drag(self, event):
+        dx, dy = event.x - self._drag[0], event.y - self._drag[1]
+        self._drag = (event.x, event.y)
+        self.offset_x += dx
+        self.offset_y += dy
+        self.canvas.move("all", dx, dy)
+        self._update_viewport()
+
+    def _zoom(self, x, y, direction):
+        zoom_level = min(max(self.zoom_level + direction, 0), len(ZOOM_LEVELS) - 1)
+        if zoom_level == self.zoom_level:
+            return
+        # el punto del mapa bajo el cursor se queda en su sitio
+        world_x = (x - self.offset_x) / self.scale
+        world_y = (y - self.offset_y) / self.scale
+        self.zoom_level = zoom_level
+        self.offset_x = x - world_x * self.scale
+        self.offset_y = y - world_y * self.scale
+
+        self.canvas.delete("all")
+        self._tile_items.clear()
+        self._car_items.clear()
+        self._traffic_light_items.clear()
+        self._walkway_items.clear()
+        self._update_viewport()
+
+    def _track_cars(self):
+        cars_coords = self.snapshot.cars_coords
+        for cid in [cid for cid in self._car_positions if cid not in cars_coords]:
+            del self._car_positions[cid]
+            self._buckets[self._car_cells.pop(cid)].discard(cid)
+
+        for cid, position in cars_coords.items():
+            if self._car_positions.get(cid) == position:
+                continue
+            self._car_positions[cid] = position
+            cell = _cell(*position)
+            previous = self._car_cells.get(cid)
+            if previous != cell:
+                if previous is not None:
+                    self._buckets[previous].discard(cid)
+                self._buckets.setdefault(cell, set()).add(cid)
+                self._car_cells[cid] = cell
 
     def _render_cars(self):
-        car_colors = {
-            State.WANDER: "black",
-            State.WANTS_TO_PARK: "yellow",
-            State.IDLE: "white",
-            State.WANTS_TO_EXIT: "red"
-        }
-        self.canvas.delete("car")
-        for cid, (x, y) in self.snapshot.cars_coords.items():
-            screen_x = x * PIXELS_PER_UNIT + self.offset_x
-            screen_y = y * PIXELS_PER_UNIT + self.offset_y
-            radius = STREET_UNITS_WIDTH * PIXELS_PER_UNIT / 2
-            self.canvas.create_oval(
-                screen_x - radius,
-                screen_y - radius,
-                screen_x + radius,
-                screen_y + radius,
-                fill=car_colors[self.snapshot.cars_color[cid]],
-                tags="car"
-            )
+        scale = self.scale
+        radius = STREET_UNITS_WIDTH * scale / 2
+        cars_coords = self._snapshot.cars_coords
+        cars_color = self._snapshot.cars_color
+        visible = set()
+        for cell in self._visible_cells:
+            visible.update(self._buckets.get(cell, ()))
+
+        for cid in [cid for cid in self._car_items if cid not in visible]:
+            self.canvas.delete(self._car_items.pop(cid)[0])
+
+        for cid in visible:
+            x, y = cars_coords[cid]
+            color = CAR_COLORS[cars_color[cid]]
+            drawn = self._car_items.get(cid)
+            if drawn is not None and drawn[1] == (x, y) and drawn[2] == color:
+                continue
+
+            screen_x = x * scale + self.offset_x
+            screen_y = y * scale + self.offset_y
+            bounds = (screen_x - radius, screen_y - radius, screen_x + radius, screen_y + radius)
+            if drawn is None:
+                item = self.canvas.create_oval(*bounds, fill=color, tags="car")
+            else:
+                item = drawn[0]
+                if drawn[1] != (x, y):
+                    self.canvas.coords(item, *bounds)
+                if drawn[2] != color:
+                    self.canvas.itemconfig(item, fill=color)
+            self._car_items[cid] = (item, (x, y), color)
 
     def _render_walkways(self):
-        self.canvas.delete("walkway")
+        scale = self.scale
         for wid, (x, y) in self.simulation_history.walkways_coords.items():
-            screen_x = x * PIXELS_PER_UNIT + self.offset_x
-            screen_y = y * PIXELS_PER_UNIT + self.offset_y
-            radius = PIXELS_PER_UNIT * 0.25
-            walkway_color = self.snapshot.walkways[wid]
-            color = {
-                TrafficColor.RED: "red",
-                TrafficColor.GREEN: "gray"
-            }[walkway_color]
-
-            self.canvas.create_rectangle(
-                screen_x - radius,
-                screen_y - radius,
-                screen_x + radius,
-                screen_y + radius,
-                fill=color,
-                outline="black",
-                width=2,
-                tags="walkway"
-            )
+            drawn = self._walkway_items.get(wid)
+            if self._walkway_cells[wid] not in self._visible_cells:
+                if drawn is not None:
+                    self.canvas.delete(self._walkway_items.pop(wid)[0])
+                continue
+
+            color = WALKWAY_COLORS[self._snapshot.walkways[wid]]
+            if drawn is None:
+                screen_x = x * scale + self.offset_x
+                screen_y = y * scale + self.offset_y
+                radius = scale * 0.25
+                item = self.canvas.create_rectangle(
+                    screen_x - radius,
+                    screen_y - radius,
+                    screen_x + radius,
+                    screen_y + radius,
+                    fill=color,
+                    outline="black",
+                    width=2,
+                    tags="walkway"
+                )
+            elif drawn[1] != color:
+                item = drawn[0]
+                self.canvas.itemconfig(item, fill=color)
+            else:
+                continue
+            self._walkway_items[wid] = (item, color)
 
     def _render_traffic_lights(self):
-        self.canvas.delete("traffic_light")
+        scale = self.scale
         for tid, (x, y) in self.simulation_history.traffic_lights_coords.items():
-            screen_x = (x - 0.5) * PIXELS_PER_UNIT + self.offset_x
-            screen_y = y * PIXELS_PER_UNIT + self.offset_y
-            radius = PIXELS_PER_UNIT * 0.33
-            color = {
-                TrafficColor.RED: "red",
-                TrafficColor.GREEN: "green"
-            }[self.snapshot.traffic_lights[tid]]
-            self.canvas.create_oval(
-                screen_x - radius,
-                screen_y - radius,
-                screen_x + radius,
-                screen_y + radius,
-                fill=color,
-                outline="orange",
-                width=4,
-                tags="traffic_light"
-            )
-
-    def _draw_street(self, x, y, dx, dy, length, color, draw_arrow):
-        orientation_arrow = {
-            Orientation.NORTH: "↑",
-            Orientation.EAST: "→",
-            Orientation.SOUTH: "↓",
-            Orientation.WEST: "←",
-        }
+            drawn = self._traffic_light_items.get(tid)
+            if self._traffic_light_cells[tid] not in self._visible_cells:
+                if drawn is not None:
+                    self.canvas.delete(self._traffic_light_items.pop(tid)[0])
+                continue
 
-        # Vector perpendicular
-        perp_dx, perp_dy = -dy, dx
-
-        # Escalar
-        scaled_dx = dx * length
-        scaled_dy = dy * length
-        perp_dx *= STREET_UNITS_WIDTH * PIXELS_PER_UNIT / 2
-        perp_dy *= STREET_UNITS_WIDTH * PIXELS_PER_UNIT / 2
-
-        # Esquinas del rectángulo
-        x1 = (x - perp_dx)
-        y1 = (y - perp_dy)
-        x2 = (x + scaled_dx - perp_dx)
-        y2 = (y + scaled_dy - perp_dy)
-        x3 = (x + scaled_dx + perp_dx)
-        y3 = (y + scaled_dy + perp_dy)
-        x4 = (x + perp_dx)
-        y4 = (y + perp_dy)
-
-        self.canvas.create_polygon(x1, y1, x2, y2, x3, y3, x4, y4, fill=color)
-
-        if draw_arrow:
-            self.canvas.create_text(
-                x + scaled_dx / 2,
-                y + scaled_dy / 2,
-                text=orientation_arrow[Orientation((dx, dy))],
-                font=("Arial", 24),
-                fill="white"
-            )
+            color = TRAFFIC_LIGHT_COLORS[self._snapshot.traffic_lights[tid]]
+            if drawn is None:
+                screen_x = (x - 0.5) * scale + self.offset_x
+                screen_y = y * scale + self.offset_y
+                radius = scale * 0.33
+                item = self.canvas.create_oval(
+                    screen_x - radius,
+                    screen_y - radius,
+                    screen_x + radius,
+                    screen_y + radius,
+                    fill=color,
+                    outline="orange",
+                    width=max(1, int(4 * ZOOM_LEVELS[self.zoom_level])),
+                    tags="traffic_light"
+                )
+            elif drawn[1] != color:
+                item = drawn[0]
+                self.canvas.itemconfig(item, fill=color)
+            else:
+                continue
+            self._traffic_light_items[tid] = (item, color)
@@ -0,0 +1,241 @@
+import json
+import logging
+import mmap
+import os
+import struct
+from array import array
+
+import numpy as np
+
+from sma.config import HISTORY_BUFFER_SIZE
+from sma.environment.circuit import SimulationHistory, SnapshotDelta
+from sma.environment.trafficlight import SignalTracks
+from sma.history.delta import DeltaFrames
+from sma.history.formats import car_ids
+
+# formato columnar:
+#   cabecera: MAGIC, versión, longitud y JSON con la geometría del mapa y el orden de semáforos y pasos de peatones
+#   frames:   tipo (keyframe o diferencias) y secciones de arrays de tamaño fijo, cada una precedida de su longitud:
+#             coches movidos (id int32, x e y float32), aparcados (id, uint8), estados (id, uint8), borrados (id) y
+#             colores de semáforos y pasos de peatones que cambian (índice uint32, color uint8)
+#   pie:      JSON con las estadísticas y las pistas de cambios de cada semáforo, tabla de offsets de cada frame (uint64)
+#             y un trailer de tamaño fijo
+MAGIC = b"SMAH"
+FOOTER_MAGIC = b"SMAF"
+# la versión 2 guarda diferencias entre frames con keyframes periódicos; en la 3 los keyframes ya no repiten los colores
+# de los semáforos, que se reconstruyen con sus pistas de cambios; en la 4 los índices de semáforos pasan de uint16 a
+# uint32 para mapas con más de 65535
+BINARY_VERSION = 4
+
+_PREAMBLE = struct.Struct("<4sHI")  # magic, versión, longitud de la cabecera
+_FRAME_KIND = struct.Struct("<B")
+_SECTION_LENGTH = struct.Struct("<I")
+_TRAILER = struct.Struct("<QIQI4s")  # offset y longitud del JSON del pie, offset de la tabla, nº de frames, magic
+_SECTIONS = (
+    ("<i4", "<f4", "<f4"),  # coches movidos
+    ("<i4", np.uint8),  # aparcados (1) y desaparcados (0)
+    ("<i4", np.uint8),  # estados de los conductores
+    ("<i4",),  # coches borrados
+    ("<u4", np.uint8),  # semáforos
+    ("<u4", np.uint8),  # pasos de peatones
+)
+KEYFRAME = 1
+DELTA = 0
+
+
+def _pairs(coords):
+    return [[int(id_), *xy] for id_, xy in coords.items()]
+
+
+class BinaryHistoryWriter:
+
+    def __init__(self, path, buffer_size=HISTORY_BUFFER_SIZE):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._file = open(path, "wb")
+        self._offsets = array("Q")
+        self._pending = 0
+        self._traffic_light_indexes = {}
+        self._walkway_indexes = {}
+        self._signal_tracks = None
+
+    @property
+    def snapshots(self):
+        return len(self._offsets)
+
+    def write_header(self, history: SimulationHistory):
+        traffic_light_ids = sorted(map(int, history.traffic_lights_coords))
+        walkway_ids = sorted(map(int, history.walkways_coords))
+        self._traffic_light_indexes = {id_: index for index, id_ in enumerate(traffic_light_ids)}
+        self._walkway_indexes = {id_: index for index, id_ in enumerate(walkway_ids)}
+        header = json.dumps({
+            "traffic_lights_coords": _pairs(history.traffic_lights_coords),
+            "walkways_coords": _pairs(history.walkways_coords),
+            "street_coords": _pairs(history.street_coords),
+            "graphic_hints": [[int(id_), hints] for id_, hints in history.graphic_hints.items()],
+            "traffic_light_ids": traffic_light_ids,
+            "walkway_ids": walkway_ids,
+            "signal_tracks": history.signal_tracks.to_dict() if history.signal_tracks is not None else None
+        }).encode()
+        self._signal_tracks = SignalTracks.from_dict(history.signal_tracks.to_dict()) \
+            if history.signal_tracks is not None else SignalTracks(traffic_lights={}, walkways={})
+        self._file.write(_PREAMBLE.pack(MAGIC, BINARY_VERSION, len(header)))
+        self._file.write(header)
+        self._file.flush()
+
+    def write_delta(self, delta: SnapshotDelta):
+        coords = np.array(list(delta.cars_coords.values()), dtype=np.float32).reshape(-1, 2)
+        parked = [*delta.cars_parked, *delta.cars_unparked]
+        sections = (
+            (car_ids(delta.cars_coords), coords[:, 0], coords[:, 1]),
+            (car_ids(parked), [1] * len(delta.cars_parked) + [0] * len(delta.cars_unparked)),
+            (car_ids(delta.cars_color), list(delta.cars_color.values())),
+            (car_ids(delta.cars_removed),),
+            (
+                [self._traffic_light_indexes[int(id_)] for id_ in delta.traffic_lights],
+                list(delta.traffic_lights.values())
+            ),
+            ([self._walkway_indexes[int(id_)] for id_ in delta.walkways], list(delta.walkways.values())),
+        )
+
+        self._signal_tracks.record(len(self._offsets), delta.traffic_lights, delta.walkways)
+        self._offsets.append(self._file.tell())
+        self._file.write(_FRAME_KIND.pack(KEYFRAME if delta.keyframe else DELTA))
+        for dtypes, columns in zip(_SECTIONS, sections):
+            self._file.write(_SECTION_LENGTH.pack(len(columns[0])))
+            for dtype, column in zip(dtypes, columns):
+                self._file.write(np.asarray(column, dtype=dtype).tobytes())
+        self._pending += 1
+        if self._pending >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._file.closed:
+            return
+        self._file.flush()
+        self._pending = 0
+
+    def close(self, stats):
+        footer = json.dumps({"stats": stats, "signal_tracks": self._signal_tracks.to_dict()}).encode()
+        footer_offset = self._file.tell()
+        self._file.write(footer)
+        table_offset = self._file.tell()
+        self._file.write(self._offsets.tobytes())
+        self._file.write(_TRAILER.pack(footer_offset, len(footer), table_offset, len(self._offsets), FOOTER_MAGIC))
+        self._file.close()
+        logging.info(f"History written to {self.path}: {len(self._offsets)} snapshots")
+
+
+class BinaryFrames(DeltaFrames):
+    # frames leídos bajo demanda del fichero mapeado en memoria; ningún frame se decodifica hasta que se pide
+
+    def __init__(self, buffer, offsets, traffic_light_ids, walkway_ids, signal_tracks):
+        super().__init__(len(offsets), self.delta, self.is_keyframe, signal_tracks)
+        self._buffer = buffer
+        self._offsets = offsets
+        self._traffic_light_ids = traffic_light_ids
+        self._walkway_ids = walkway_ids
+
+    def is_keyframe(self, index):
+        return self._buffer[int(self._offsets[index])] == KEYFRAME
+
+    def frame_arrays(self, index):
+        return _read_frame(self._buffer, int(self._offsets[index]))[1]
+
+    def delta(self, index) -> SnapshotDelta:
+        cars, parked, states, removed, traffic_lights, walkways = (
+            [column.tolist() for column in columns]
+            for columns in self.frame_arrays(index)
+        )
+        ids, xs, ys = cars
+        parked_ids, parked_flags = parked
+        return SnapshotDelta(
+            keyframe=self.is_keyframe(index),
+            traffic_lights={self._traffic_light_ids[i]: color for i, color in zip(*traffic_lights)},
+            walkways={self._walkway_ids[i]: color for i, color in zip(*walkways)},
+            cars_coords=dict(zip(ids, zip(xs, ys))),
+            cars_parked={car_id for car_id, flag in zip(parked_ids, parked_flags) if flag},
+            cars_unparked={car_id for car_id, flag in zip(parked_ids, parked_flags) if not flag},
+            cars_color=dict(zip(*states)),
+            cars_removed=set(removed[0])
+        )
+
+
+def _read_frame(buffer, offset):
+    (kind,) = _FRAME_KIND.unpack_from(buffer, offset)
+    offset += _FRAME_KIND.size
+    sections = []
+    for dtypes in _SECTIONS:
+        (length,) = _SECTION_LENGTH.unpack_from(buffer, offset)
+        offset += _SECTION_LENGTH.size
+        columns = []
+        for dtype in dtypes:
+            column = np.frombuffer(buffer, dtype=dtype, count=length, offset=offset)
+            columns.append(column)
+            offset += column.nbytes
+        sections.append(columns)
+    return kind, sections, offset
+
+
+def read_binary_history(path) -> SimulationHistory:
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _PREAMBLE.size:
+            raise ValueError(f"{path} is not a binary history: {size} bytes, shorter than its preamble")
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, header_length = _PREAMBLE.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a binary history")
+    if version != BINARY_VERSION:
+        raise ValueError(f"{path} has binary history version {version}, expected {BINARY_VERSION}")
+    if size < _PREAMBLE.size + header_length:
+        raise ValueError(f"{path} is truncated: {size} bytes, the header alone takes {_PREAMBLE.size + header_length}")
+    header = json.loads(buffer[_PREAMBLE.size:_PREAMBLE.size + header_length])
+    traffic_light_ids = header["traffic_light_ids"]
+    walkway_ids = header["walkway_ids"]
+    frames_start = _PREAMBLE.size + header_length
+
+    stats = {}
+    trailer = _TRAILER.unpack_from(buffer, len(buffer) - _TRAILER.size) if len(buffer) >= _TRAILER.size else None
+    if trailer is not None and trailer[-1] == FOOTER_MAGIC:
+        footer_offset, footer_length, table_offset, frames, _ = trailer
+        footer = json.loads(buffer[footer_offset:footer_offset + footer_length])
+        stats = footer["stats"]
+        signal_tracks = SignalTracks.from_dict(footer["signal_tracks"])
+        offsets = np.frombuffer(buffer, dtype="<u8", count=frames, offset=table_offset)
+        frames_end = footer_offset
+    else:
+        # ejecución interrumpida: sin tabla de offsets ni pistas de semáforos, se recorren los frames completos
+        logging.warning(f"{path} has no footer, scanning frames")
+        signal_tracks = SignalTracks.from_dict(header["signal_tracks"]) if header["signal_tracks"] \
+            else SignalTracks(traffic_lights={}, walkways={})
+        offsets = array("Q")
+        offset = frames_start
+        while True:
+            try:
+                _, sections, next_offset = _read_frame(buffer, offset)
+            except (struct.error, ValueError):
+                break
+            traffic_lights, walkways = sections[-2:]
+            signal_tracks.record(
+                len(offsets),
+                {traffic_light_ids[i]: color for i, color in zip(*traffic_lights)},
+                {walkway_ids[i]: color for i, color in zip(*walkways)}
+            )
+            offsets.append(offset)
+            offset = next_offset
+        frames_end = offset
+
+    history = SimulationHistory(
+        streets={},
+        traffic_lights_coords={id_: (x, y) for id_, x, y in header["traffic_lights_coords"]},
+        walkways_coords={id_: (x, y) for id_, x, y in header["walkways_coords"]},
+        street_coords={id_: (x, y) for id_, x, y in header["street_coords"]},
+        history=BinaryFrames(buffer, offsets, traffic_light_ids, walkway_ids, signal_tracks),
+        graphic_hints={id_: hints for id_, hints in header["graphic_hints"]},
+        signal_tracks=signal_tracks
+    )
+    history.stats = stats
+    logging.info(f"Binary history {path}: {len(offsets)} frames, {frames_end - frames_start} bytes")
+    return history
@@ -0,0 +1,33 @@
+import argparse
+import logging
+
+from sma.config import HISTORY_KEYFRAME_INTERVAL
+from sma.history.delta import DeltaEncoder
+from sma.history.formats import history_writer, load_history, write_json_history
+
+
+def convert_history(source, target, keyframe_interval=HISTORY_KEYFRAME_INTERVAL):
+    history = load_history(source)
+    writer = history_writer(target)
+    if writer is None:
+        history.history = list(history.history)
+        write_json_history(history, target)
+        return
+
+    writer.write_header(history)
+    encoder = DeltaEncoder(keyframe_interval)
+    for snapshot in history.history:
+        writer.write_delta(encoder.encode(snapshot))
+    writer.close(history.stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a simulation history between formats")
+    parser.add_argument("source", type=str, help="History file (.json, .ndjson or .hist)")
+    parser.add_argument("target", type=str, help="Output file, format chosen by extension")
+    parser.add_argument("--keyframe-interval", type=int, default=HISTORY_KEYFRAME_INTERVAL,
+                        help="Snapshots between keyframes, 0 to store every snapshot in full")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    convert_history(args.source, args.target, args.keyframe_interval)
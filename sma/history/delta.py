@@ -0,0 +1,110 @@
+from collections.abc import Sequence
+
+from sma.environment.circuit import SimulationSnapshot, SnapshotDelta
+
+
+# estado de los coches en un frame, reconstruido aplicando diferencias sobre el último keyframe
+class FrameState:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.cars_coords = {}
+        self.cars_parked = set()
+        self.cars_color = {}
+
+    def apply(self, delta: SnapshotDelta):
+        if delta.keyframe:
+            self.reset()
+        for car_id in delta.cars_removed:
+            self.cars_coords.pop(car_id, None)
+            self.cars_parked.discard(car_id)
+            self.cars_color.pop(car_id, None)
+        self.cars_coords.update(delta.cars_coords)
+        self.cars_parked |= delta.cars_parked
+        self.cars_parked -= delta.cars_unparked
+        self.cars_color.update(delta.cars_color)
+
+    def snapshot(self, traffic_lights, walkways) -> SimulationSnapshot:
+        return SimulationSnapshot(
+            traffic_lights=traffic_lights,
+            walkways=walkways,
+            cars_coords=dict(self.cars_coords),
+            cars_parked=set(self.cars_parked),
+            cars_color=dict(self.cars_color)
+        )
+
+
+class DeltaFrames(Sequence):
+    # secuencia de snapshots completos a partir de diferencias; el último frame reconstruido se conserva para que la
+    # reproducción en orden aplique una sola diferencia por frame, y los semáforos se consultan en sus pistas de cambios
+
+    def __init__(self, count, load, is_keyframe, signal_tracks):
+        self._count = count
+        self._load = load
+        self._is_keyframe = is_keyframe
+        self.signal_tracks = signal_tracks
+        self._state = FrameState()
+        self._index = None
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+
+        keyframe = index
+        while keyframe > 0 and not self._is_keyframe(keyframe):
+            keyframe -= 1
+        if self._index is None or not keyframe <= self._index <= index:
+            self._state.reset()
+            self._index = keyframe - 1
+        for i in range(self._index + 1, index + 1):
+            self._state.apply(self._load(i))
+        self._index = index
+        return self._state.snapshot(*self.signal_tracks.colors_at(index))
+
+
+def _changed(previous, current):
+    return {key: value for key, value in current.items() if previous.get(key) != value}
+
+
+# diferencias entre snapshots completos consecutivos, para convertir históricos antiguos; los colores de los semáforos
+# son siempre cambios respecto al frame anterior, como en los que escribe el circuito
+class DeltaEncoder:
+
+    def __init__(self, keyframe_interval):
+        self.keyframe_interval = keyframe_interval
+        self._count = 0
+        self._previous = None
+
+    def encode(self, snapshot: SimulationSnapshot) -> SnapshotDelta:
+        keyframe = self._previous is None or self.keyframe_interval <= 0 or self._count % self.keyframe_interval == 0
+        self._count += 1
+        previous, self._previous = self._previous, snapshot
+        if keyframe:
+            delta = SnapshotDelta.from_snapshot(snapshot)
+            if previous is not None:
+                delta.traffic_lights = _changed(previous.traffic_lights, snapshot.traffic_lights)
+                delta.walkways = _changed(previous.walkways, snapshot.walkways)
+            return delta
+
+        parked = set(snapshot.cars_parked or ())
+        previous_parked = set(previous.cars_parked or ())
+        removed = previous.cars_coords.keys() - snapshot.cars_coords.keys()
+        return SnapshotDelta(
+            keyframe=False,
+            traffic_lights=_changed(previous.traffic_lights, snapshot.traffic_lights),
+            walkways=_changed(previous.walkways, snapshot.walkways),
+            cars_coords=_changed(previous.cars_coords, snapshot.cars_coords),
+            cars_parked=parked - previous_parked,
+            cars_unparked=previous_parked - parked - removed,
+            cars_color=_changed(previous.cars_color, snapshot.cars_color),
+            cars_removed=removed
+        )
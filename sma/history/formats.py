@@ -0,0 +1,66 @@
+import json
+from enum import Enum
+
+from sma.environment.circuit import SimulationHistory, SimulationSnapshot
+
+
+def car_ids(values):
+    # los históricos JSON convertidos traen los ids de los coches como cadenas
+    return [int(id_) for id_ in values]
+
+
+# formato del histórico según la extensión: .hist (binario columnar), .ndjson (JSON por líneas) o .json (un único
+# volcado al final de la simulación). Los módulos de cada formato importan car_ids de aquí, así que este los importa
+# al usarlos
+def history_writer(path):
+    from sma.history.binary import BinaryHistoryWriter
+    from sma.history.ndjson import NdjsonHistoryWriter
+
+    if path.endswith(".json"):
+        return None
+    if path.endswith(".ndjson"):
+        return NdjsonHistoryWriter(path)
+    return BinaryHistoryWriter(path)
+
+
+def load_history(path) -> SimulationHistory:
+    from sma.history.binary import read_binary_history, MAGIC
+    from sma.history.ndjson import read_ndjson_history
+
+    with open(path, "rb") as f:
+        is_binary = f.read(len(MAGIC)) == MAGIC
+    # un .hist vacío o sin magic lo rechaza el lector binario con un error de formato
+    if is_binary or path.endswith(".hist"):
+        return read_binary_history(path)
+    if path.endswith(".ndjson"):
+        return read_ndjson_history(path)
+    return read_json_history(path)
+
+
+def write_json_history(history, path):
+    with open(path, "w") as f:
+
+        def to_dict(o):
+            if isinstance(o, Enum):
+                return o.value
+            if hasattr(o, "__dict__"):
+                return o.__dict__
+
+        streets = history.streets
+        history.streets = []
+        json.dump(history, f, default=to_dict)
+        history.streets = streets
+
+
+def read_json_history(path) -> SimulationHistory:
+    with open(path) as f:
+        data = json.load(f)
+        stats = data.pop("stats", {})
+        history = SimulationHistory(**data)
+        history.history = [
+            SimulationSnapshot(**snapshot)
+            for snapshot
+            in history.history
+        ]
+        history.stats = stats
+    return history
@@ -0,0 +1,139 @@
+import json
+import logging
+
+from sma.config import HISTORY_BUFFER_SIZE
+from sma.environment.circuit import SimulationHistory, SimulationSnapshot, SnapshotDelta
+from sma.environment.trafficlight import SignalTracks
+from sma.history.delta import DeltaFrames
+from sma.history.formats import car_ids
+
+# la versión 2 añade los registros "keyframe" y "delta"; en la 3 los colores de semáforos de cada registro son sólo los
+# que cambian y la cabecera guarda el color inicial de cada uno
+NDJSON_VERSION = 3
+
+
+# histórico en JSON por líneas: una cabecera, una línea por snapshot y las estadísticas al final; los snapshots se
+# escriben por bloques, así que la memoria no crece con la duración y una ejecución interrumpida deja un fichero legible
+class NdjsonHistoryWriter:
+
+    def __init__(self, path, buffer_size=HISTORY_BUFFER_SIZE):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.snapshots = 0
+        self._file = open(path, "w")
+        self._buffer = []
+
+    def write_header(self, history: SimulationHistory):
+        self._write_line({
+            "type": "header",
+            "version": NDJSON_VERSION,
+            "traffic_lights_coords": history.traffic_lights_coords,
+            "walkways_coords": history.walkways_coords,
+            "street_coords": history.street_coords,
+            "graphic_hints": history.graphic_hints,
+            "signal_tracks": history.signal_tracks.to_dict() if history.signal_tracks is not None else None
+        })
+        self._file.flush()
+
+    def write_delta(self, delta: SnapshotDelta):
+        self._buffer.append(json.dumps({
+            "type": "keyframe" if delta.keyframe else "delta",
+            "traffic_lights": delta.traffic_lights,
+            "walkways": delta.walkways,
+            "cars_coords": delta.cars_coords,
+            "cars_parked": sorted(delta.cars_parked),
+            "cars_unparked": sorted(delta.cars_unparked),
+            "cars_color": delta.cars_color,
+            "cars_removed": sorted(delta.cars_removed)
+        }))
+        self.snapshots += 1
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._file.closed:
+            return
+        if self._buffer:
+            self._file.write("\n".join(self._buffer) + "\n")
+            self._buffer = []
+        self._file.flush()
+
+    def close(self, stats):
+        self.flush()
+        self._write_line({"type": "stats", "stats": stats})
+        self._file.close()
+        logging.info(f"History written to {self.path}: {self.snapshots} snapshots")
+
+    def _write_line(self, record):
+        self._file.write(json.dumps(record) + "\n")
+
+
+def _int_keys(values):
+    # JSON guarda las claves de los diccionarios como cadenas
+    return {int(key): value for key, value in values.items()}
+
+
+def _coords(values):
+    return {int(key): tuple(value) for key, value in values.items()}
+
+
+def read_ndjson_history(path) -> SimulationHistory:
+    header = None
+    frames = []
+    stats = {}
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # última línea a medio escribir de una ejecución interrumpida
+                logging.warning(f"Truncated history at line {line_number} of {path}")
+                break
+
+            match record.pop("type"):
+                case "header":
+                    header = record
+                case "snapshot":
+                    frames.append(SimulationSnapshot(
+                        traffic_lights=_int_keys(record["traffic_lights"]),
+                        walkways=_int_keys(record["walkways"]),
+                        cars_coords=_coords(record["cars_coords"]),
+                        cars_parked=set(car_ids(record["cars_parked"])),
+                        cars_color=_int_keys(record["cars_color"])
+                    ))
+                case ("keyframe" | "delta") as record_type:
+                    frames.append(SnapshotDelta(
+                        keyframe=record_type == "keyframe",
+                        traffic_lights=_int_keys(record["traffic_lights"]),
+                        walkways=_int_keys(record["walkways"]),
+                        cars_coords=_coords(record["cars_coords"]),
+                        cars_parked=set(car_ids(record["cars_parked"])),
+                        cars_unparked=set(car_ids(record["cars_unparked"])),
+                        cars_color=_int_keys(record["cars_color"]),
+                        cars_removed=set(car_ids(record["cars_removed"]))
+                    ))
+                case "stats":
+                    stats = record["stats"]
+
+    if header is None:
+        raise ValueError(f"{path} has no history header")
+    if header["version"] > NDJSON_VERSION:
+        raise ValueError(f"{path} has NDJSON history version {header['version']}, expected {NDJSON_VERSION}")
+
+    if frames and isinstance(frames[0], SnapshotDelta):
+        deltas = frames
+        signal_tracks = SignalTracks.from_dict(header["signal_tracks"]) if header.get("signal_tracks") \
+            else SignalTracks(traffic_lights={}, walkways={})
+        for index, delta in enumerate(deltas):
+            signal_tracks.record(index, delta.traffic_lights, delta.walkways)
+        frames = DeltaFrames(len(deltas), deltas.__getitem__, lambda index: deltas[index].keyframe, signal_tracks)
+    history = SimulationHistory(
+        streets={},
+        traffic_lights_coords=_coords(header["traffic_lights_coords"]),
+        walkways_coords=_coords(header["walkways_coords"]),
+        street_coords=_coords(header["street_coords"]),
+        history=frames,
+        graphic_hints=_int_keys(header["graphic_hints"])
+    )
+    history.stats = stats
+    return history
@@ -0,0 +1,161 @@
+import math
+
+from PIL import Image, ImageDraw
+
+from sma.agent.driver import State
+from sma.config import MARGIN
+from sma.environment.circuit import SimulationHistory, SimulationSnapshot
+from sma.environment.circuitmap import STREET_UNITS_WIDTH
+from sma.environment.trafficlight import TrafficColor
+
+CAR_COLORS = {
+    State.WANDER: "black",
+    State.WANTS_TO_PARK: "yellow",
+    State.IDLE: "white",
+    State.WANTS_TO_EXIT: "red"
+}
+TRAFFIC_LIGHT_COLORS = {
+    TrafficColor.RED: "red",
+    TrafficColor.GREEN: "green"
+}
+WALKWAY_COLORS = {
+    TrafficColor.RED: "red",
+    TrafficColor.GREEN: "gray"
+}
+STREET_COLOR = "gray"
+PARKING_COLOR = "blue"
+ARROW_COLOR = "white"
+BACKGROUND_COLOR = "white"
+_GRID_CELL_SIZE = 8  # unidades de calle por celda del índice espacial de la capa estática
+
+
+def _rectangle(x, y, dx, dy, length):
+    perp_x = -dy * STREET_UNITS_WIDTH / 2
+    perp_y = dx * STREET_UNITS_WIDTH / 2
+    return [
+        (x - perp_x, y - perp_y),
+        (x + dx * length - perp_x, y + dy * length - perp_y),
+        (x + dx * length + perp_x, y + dy * length + perp_y),
+        (x + perp_x, y + perp_y)
+    ]
+
+
+def _arrow(x, y, dx, dy, length):
+    middle_x = x + dx * length / 2
+    middle_y = y + dy * length / 2
+    size = STREET_UNITS_WIDTH * 0.3
+    return [
+        (middle_x + dx * size, middle_y + dy * size),
+        (middle_x - dx * size - dy * size, middle_y - dy * size + dx * size),
+        (middle_x - dx * size + dy * size, middle_y - dy * size - dx * size)
+    ]
+
+
+# polígonos (en unidades de calle) de calles, aparcamientos y flechas de sentido, en orden de dibujo
+def street_shapes(history: SimulationHistory):
+    shapes = []
+    for sid, (x, y) in history.street_coords.items():
+        street = history.streets[int(sid)]
+        dx, dy = street.orientation.value
+
+        if street.has_parking:
+            perp_x, perp_y = dy, -dx
+            if "PARKING LEFT" in history.graphic_hints.get(sid, {}):
+                perp_x *= -1
+                perp_y *= -1
+            parking_x = x + perp_x * STREET_UNITS_WIDTH
+            parking_y = y + perp_y * STREET_UNITS_WIDTH
+            shapes.append((_rectangle(parking_x, parking_y, dx, dy, street.length), PARKING_COLOR))
+
+        shapes.append((_rectangle(x, y, dx, dy, street.length), STREET_COLOR))
+        shapes.append((_arrow(x, y, dx, dy, street.length), ARROW_COLOR))
+    return shapes
+
+
+# calles del mapa dibujadas con PIL por regiones; un índice espacial limita cada región a las calles que la tocan
+class StaticLayer:
+
+    def __init__(self, history: SimulationHistory):
+        self.shapes = street_shapes(history)
+        self._grid = {}
+        points = [point for polygon, _ in self.shapes for point in polygon] or [(0, 0)]
+        self.bounds = (
+            min(x for x, _ in points),
+            min(y for _, y in points),
+            max(x for x, _ in points),
+            max(y for _, y in points)
+        )
+        for index, (polygon, _) in enumerate(self.shapes):
+            for cell in self._cells(*self._bounding_box(polygon)):
+                self._grid.setdefault(cell, []).append(index)
+
+    def shapes_in(self, min_x, min_y, max_x, max_y):
+        indexes = set()
+        for cell in self._cells(min_x, min_y, max_x, max_y):
+            indexes.update(self._grid.get(cell, ()))
+        return [self.shapes[index] for index in sorted(indexes)]
+
+    def render(self, scale, left, top, width, height, image=None):
+        # región de la capa en píxeles (coordenadas del mapa multiplicadas por scale) a partir de (left, top)
+        image = image or Image.new("RGB", (width, height), BACKGROUND_COLOR)
+        draw = ImageDraw.Draw(image)
+        shapes = self.shapes_in(left / scale, top / scale, (left + width) / scale, (top + height) / scale)
+        for polygon, color in shapes:
+            draw.polygon([(x * scale - left, y * scale - top) for x, y in polygon], fill=color)
+        return image
+
+    @staticmethod
+    def _bounding_box(polygon):
+        xs = [x for x, _ in polygon]
+        ys = [y for _, y in polygon]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    @staticmethod
+    def _cells(min_x, min_y, max_x, max_y):
+        for cell_x in range(math.floor(min_x / _GRID_CELL_SIZE), math.floor(max_x / _GRID_CELL_SIZE) + 1):
+            for cell_y in range(math.floor(min_y / _GRID_CELL_SIZE), math.floor(max_y / _GRID_CELL_SIZE) + 1):
+                yield cell_x, cell_y
+
+
+# frames completos sin ventana: la capa estática se dibuja una vez y cada frame añade semáforos y coches sobre una copia
+class FrameRenderer:
+
+    def __init__(self, history: SimulationHistory, static_layer: StaticLayer, scale):
+        self.history = history
+        self.scale = scale
+        xs = [x for x, _ in history.traffic_lights_coords.values()] + [x for x, _ in history.walkways_coords.values()]
+        ys = [y for _, y in history.traffic_lights_coords.values()] + [y for _, y in history.walkways_coords.values()]
+        min_x, min_y, max_x, max_y = static_layer.bounds
+        min_x, min_y = min([min_x, *xs]) - 1, min([min_y, *ys]) - 1
+        max_x, max_y = max([max_x, *xs]) + 1, max([max_y, *ys]) + 1
+        self.left = math.floor(min_x * scale) - MARGIN
+        self.top = math.floor(min_y * scale) - MARGIN
+        self.width = math.ceil(max_x * scale) + MARGIN - self.left
+        self.height = math.ceil(max_y * scale) + MARGIN - self.top
+        # con paleta, porque comprimir el PNG de un frame en RGB cuesta varias veces más que dibujarlo
+        background = Image.new("P", (self.width, self.height), BACKGROUND_COLOR)
+        self.background = static_layer.render(scale, self.left, self.top, self.width, self.height, background)
+
+    def render(self, snapshot: SimulationSnapshot):
+        image = self.background.copy()
+        draw = ImageDraw.Draw(image)
+
+        radius = self.scale * 0.33
+        for tid, (x, y) in self.history.traffic_lights_coords.items():
+            color = TRAFFIC_LIGHT_COLORS[snapshot.traffic_lights[tid]]
+            draw.ellipse(self._box(x - 0.5, y, radius), fill=color, outline="orange", width=max(1, round(radius / 4)))
+
+        radius = self.scale * 0.25
+        for wid, (x, y) in self.history.walkways_coords.items():
+            color = WALKWAY_COLORS[snapshot.walkways[wid]]
+            draw.rectangle(self._box(x, y, radius), fill=color, outline="black", width=max(1, round(radius / 6)))
+
+        radius = STREET_UNITS_WIDTH * self.scale / 2
+        for cid, (x, y) in snapshot.cars_coords.items():
+            draw.ellipse(self._box(x, y, radius), fill=CAR_COLORS[snapshot.cars_color[cid]], outline="black")
+        return image
+
+    def _box(self, x, y, radius):
+        screen_x = x * self.scale - self.left
+        screen_y = y * self.scale - self.top
+        return screen_x - radius, screen_y - radius, screen_x + radius, screen_y + radius
@@ -0,0 +1,57 @@
+import logging
+
+from autogen_core import SingleThreadedAgentRuntime
+
+from sma.agent.driver import DriverAgent
+from sma.agent.parker import ParkerAgent
+from sma.agent.planner import PlannerAgent
+from sma.agent.bus import DirectMessageBus
+from sma.config import PLANNER_WORKERS, MESSAGE_TRANSPORT
+from sma.environment.circuit import Circuit
+
+TRANSPORTS = {
+    "autogen": SingleThreadedAgentRuntime,
+    "direct": DirectMessageBus
+}
+
+
+async def simulation(circuit: Circuit, steps, steps_pre_simulation, delta, planner_workers=PLANNER_WORKERS,
+                     snapshots=True, transport=MESSAGE_TRANSPORT):
+    # cada circuito tiene su propio runtime y sus agentes se crean ligados a él, así que varias simulaciones pueden
+    # ejecutarse a la vez en el mismo bucle de eventos (asyncio.gather)
+    agent_runtime = TRANSPORTS[transport]()
+    instrument = (lambda agent: agent) if circuit.message_stats is None else circuit.message_stats.instrument
+    if circuit.message_stats is not None:
+        circuit.message_stats.attach(agent_runtime)
+
+    await DriverAgent.register(
+        agent_runtime,
+        "driver",
+        lambda: instrument(DriverAgent(circuit))
+    )
+    await ParkerAgent.register(
+        agent_runtime,
+        "parker",
+        lambda: instrument(ParkerAgent(circuit))
+    )
+    await PlannerAgent.register(
+        agent_runtime,
+        "planner",
+        lambda: instrument(PlannerAgent(circuit, workers=planner_workers))
+    )
+
+    agent_runtime.start()
+    circuit.set_agent_runtime(agent_runtime)
+
+    logging.info(f"Start simulation")
+    for i in range(steps_pre_simulation):
+        await circuit.step(delta)
+
+    for i in range(steps):
+        await circuit.step(delta)
+        if snapshots:
+            circuit.take_snapshot()
+
+    logging.info(f"End simulation: number of steps: {steps}")
+    circuit.finish()
+    await agent_runtime.stop()
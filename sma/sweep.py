@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import csv
+import itertools
+import logging
+import math
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sma.config import SIMULATION_DELTA, SECONDS, SECONDS_PRE_SIMULATION, MAX_CARS, SPAWN_PROBABILITY, \
+    UNPARK_PROBABILITY, MESSAGE_TRANSPORT
+from sma.environment.circuit import Circuit
+from sma.environment.circuitmap import CircuitMap
+from sma.simulation import simulation, TRANSPORTS
+
+# parámetros que se pueden barrer, con su tipo y valor por defecto
+PARAMETERS = {
+    "max_cars": (int, MAX_CARS),
+    "spawn_probability": (float, SPAWN_PROBABILITY),
+    "unpark_probability": (float, UNPARK_PROBABILITY),
+    "seconds": (float, SECONDS),
+    "seconds_pre_simulation": (float, SECONDS_PRE_SIMULATION),
+    "vectorized": (lambda value: value.lower() in ("1", "true", "yes"), False),
+    "transport": (str, MESSAGE_TRANSPORT),
+}
+# valores críticos de la t de Student para intervalos del 95% según los grados de libertad; a partir de 30, la normal
+_T_95 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131,
+         2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+
+# mapa compilado que recibe cada proceso del pool, compartido por todas sus ejecuciones
+_worker_map = None
+
+
+def init_sweep_worker(circuit_map):
+    global _worker_map
+    _worker_map = circuit_map
+    logging.disable(logging.CRITICAL)
+
+
+def run_in_worker(parameters, seed):
+    return run_simulation(_worker_map, parameters, seed)
+
+
+def run_simulation(circuit_map, parameters, seed):
+    circuit = Circuit(circuit_map, random.Random(seed))
+    if parameters["vectorized"]:
+        circuit.enable_kinematics_engine()
+    circuit.max_cars = parameters["max_cars"]
+    circuit.spawn_probability = parameters["spawn_probability"]
+    circuit.unpark_probability = parameters["unpark_probability"]
+
+    steps = int(parameters["seconds"] / SIMULATION_DELTA)
+    steps_pre_simulation = int(parameters["seconds_pre_simulation"] / SIMULATION_DELTA)
+    asyncio.run(simulation(circuit, steps, steps_pre_simulation, SIMULATION_DELTA, planner_workers=0, snapshots=False,
+                           transport=parameters["transport"]))
+    return _flatten(circuit.history.stats)
+
+
+def _flatten(stats, prefix=""):
+    # las estadísticas de los servicios van anidadas; sólo interesan las numéricas
+    values = {}
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            values.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[f"{prefix}{key}"] = value
+    return values
+
+
+def parameter_grid(values):
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*values.values())]
+
+
+def summarize(samples):
+    mean = statistics.fmean(samples)
+    if len(samples) < 2:
+        return mean, 0.0, math.nan
+    std = statistics.stdev(samples)
+    t = _T_95[len(samples) - 2] if len(samples) - 1 <= len(_T_95) else 1.960
+    return mean, std, t * std / math.sqrt(len(samples))
+
+
+def sweep(circuit_map, grid, seeds, workers=None):
+    workers = os.cpu_count() if workers is None else workers
+    runs = [(index, {**{name: default for name, (_, default) in PARAMETERS.items()}, **parameters}, seed)
+            for index, parameters in enumerate(grid) for seed in seeds]
+    results = [[] for _ in grid]
+
+    start_time = time.perf_counter()
+    if workers <= 1:
+        for done, (index, parameters, seed) in enumerate(runs, start=1):
+            results[index].append(run_simulation(circuit_map, parameters, seed))
+            logging.info(f"Run {done}/{len(runs)} finished")
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_sweep_worker, initargs=(circuit_map,)) as executor:
+            futures = {
+                executor.submit(run_in_worker, parameters, seed): index
+                for index, parameters, seed in runs
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]].append(future.result())
+                logging.info(f"Run {done}/{len(runs)} finished")
+    logging.info(f"{len(runs)} runs in {time.perf_counter() - start_time:.1f}s")
+
+    table = []
+    for parameters, stats in zip(grid, results):
+        row = {**parameters, "runs": len(stats)}
+        for metric in sorted(set().union(*stats)):
+            samples = [values[metric] for values in stats if metric in values]
+            mean, std, ci = summarize(samples)
+            row[f"{metric}.mean"] = mean
+            row[f"{metric}.std"] = std
+            row[f"{metric}.ci95"] = ci
+        table.append(row)
+    return table
+
+
+def _parse_parameter(text):
+    name, _, values = text.partition("=")
+    if name not in PARAMETERS:
+        raise argparse.ArgumentTypeError(f"Unknown parameter {name}, expected one of {', '.join(PARAMETERS)}")
+    parse = PARAMETERS[name][0]
+    values = [parse(value) for value in values.split(",")]
+    if name == "transport" and not set(values) <= TRANSPORTS.keys():
+        raise argparse.ArgumentTypeError(f"Unknown transport, expected one of {', '.join(TRANSPORTS)}")
+    return name, values
+
+
+def write_table(table, output):
+    columns = list(dict.fromkeys(column for row in table for column in row))
+    writer = csv.DictWriter(output, fieldnames=columns)
+    writer.writeheader()
+    writer.writerows(table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run headless simulations over a parameter grid and several seeds")
+    parser.add_argument("map", type=str, help="Map file")
+    parser.add_argument("--param", type=_parse_parameter, action="append", default=[],
+                        help="Parameter and comma separated values, e.g. spawn_probability=0.1,0.3")
+    parser.add_argument("--seeds", type=int, default=10, help="Runs of each configuration, seeded 0..N-1")
+    parser.add_argument("--workers", type=int, help="Processes used to run simulations, 1 to run in this process")
+    parser.add_argument("--output", type=str, help="CSV file for the aggregated table (stdout by default)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    table = sweep(CircuitMap.load(args.map), parameter_grid(dict(args.param)), range(args.seeds), args.workers)
+    if args.output is None:
+        write_table(table, sys.stdout)
+    else:
+        with open(args.output, "w", newline="") as f:
+            write_table(table, f)